@@ -8,9 +8,21 @@
 
 from tqdm import tqdm  # 导入tqdm库
 import argparse
+import asyncio
+import inspect
+import io
 import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext, redirect_stdout
 from pathlib import Path  # 用于路径验证
-from Assign1_func import normalize_doc  # 导入预处理函数
+import Assign1_func
+from Assign1_func import normalize_doc, normalize_doc_tokens, normalize_doc_stream, normalize_doc_segments, StageProfiler, ensure_nltk_data, open_lemma_cache, flush_lemma_cache, lemma_cache_info  # 导入预处理函数
+import util
 from util import * # 导入需要的函数
 import sys
 sys.stdout.reconfigure(encoding='utf-8')
@@ -19,6 +31,25 @@ def main():
     # 解析命令行参数
     parser = argparse.ArgumentParser(description="处理书籍列表并生成结果（配置文件为JSON格式）")
     parser.add_argument('config_file', help="书籍列表配置文件路径（如 booklist.json）")
+    parser.add_argument('--stream', action='store_true', help="流式处理：按段落分块读取、预处理并写出，内存占用不随书籍大小增长")
+    parser.add_argument('--chunk_size', type=int, default=65536, help="流式处理时每块的目标字符数")
+    parser.add_argument('--workers', type=int, default=1, help="并行处理书籍的进程数（默认1，即串行）")
+    parser.add_argument('--lemma_cache', default=None, help="词形还原磁盘缓存路径（sqlite），重复运行时跳过WordNet查询")
+    parser.add_argument('--cache_dir', default=None, help="预处理结果缓存目录；源文件和参数未变的书籍直接复用缓存结果")
+    parser.add_argument('--cache_max_mb', type=int, default=1024, help="预处理结果缓存的大小上限（MB），超出时淘汰最久未使用的条目")
+    parser.add_argument('--refresh', action='store_true', help="忽略已有的预处理缓存，重新处理并更新缓存")
+    parser.add_argument('--jieba_cache', default=None, help="jieba前缀词典的磁盘缓存路径（构建一次，之后各进程直接加载）")
+    parser.add_argument('--jieba_userdict', action='append', default=[], help="jieba用户词典路径，可重复指定")
+    parser.add_argument('--profile', action='store_true', help="分阶段记录预处理的时间、字符/token数和峰值内存，并在报告中输出表格")
+    parser.add_argument('--profile_json', default=None, help="将各书籍的分阶段统计写入该JSON文件（隐含--profile）")
+    parser.add_argument('--manifest', default=None, help="运行清单路径（默认<配置文件>.manifest.json）：每次运行都逐本记录完成状态、输出路径、统计结果和报告")
+    parser.add_argument('--resume', action='store_true', help="从运行清单续跑：跳过已完成的书籍，并由清单重建其报告（中断的运行无需额外参数即已记录清单）")
+    parser.add_argument('--token_ids', action='store_true', help="同时保存token id二进制文件（词表、uint32 id数组和偏移数组，可用numpy.memmap读取）")
+    parser.add_argument('--freq_matrix', default=None, help="将书单的书籍×词词频矩阵保存为.npz（需要--token_ids）")
+    parser.add_argument('--download_dir', default=DOWNLOAD_DIR, help="书单中URL的下载缓存目录（已缓存且未修改的文件不重新下载）")
+    parser.add_argument('--download_concurrency', type=int, default=4, help="同时下载的URL数")
+    parser.add_argument('--download_retries', type=int, default=3, help="下载失败（连接错误、超时、429/5xx）时的重试次数")
+    parser.add_argument('--offline', action='store_true', help="离线模式：只检查本地NLTK数据，不访问网络下载（也可设置环境变量NLTK_OFFLINE=1）")
     args = parser.parse_args()
 
     # 读取JSON配置
@@ -35,86 +66,533 @@ def main():
     
     print("# 预处理结果报告") 
     
-    for book_name, file_path in tqdm(book_dict.items(), desc="处理书籍"):
-        print(f"\n## 处理书籍：《{book_name}》")
-        print(f"\n### 书籍路径和处理参数")
-        print(f"* 源文件路径: {file_path}")
-
-        # 获取预处理参数
-        if book_name not in params_dict:
-            print(f"警告: 未找到 {book_name} 的预处理参数，使用默认值")
-            params = {
-                "html_stripping": True,
-                "contraction_expansion": True,
-                "accented_char_removal": True,
-                "text_lower_case": True,
-                "text_lemmatization": True,
-                "special_char_removal": True,
-                "stopword_removal": True,
-                "remove_digits": False,
-                "zh_simplification": True,
-                "isDebug": False
-            }
+    args.profile = args.profile or bool(args.profile_json)
+    # 每次运行都记录运行清单，任何中断的运行之后都可以用--resume续跑
+    if not args.manifest:
+        args.manifest = str(Path(args.config_file).with_suffix('.manifest.json'))
+    manifest = load_manifest(args.manifest)
+
+    # 续跑：已完成且源文件与参数未变的书籍不再处理，报告由清单重建
+    finished = {}
+    if args.resume:
+        for book_name, file_path in book_dict.items():
+            entry = manifest['books'].get(book_name)
+            if isinstance(entry, dict) and entry.get('status') == 'done' and entry.get('result') is not None \
+                    and entry.get('signature') == book_signature(file_path, params_dict.get(book_name), args):
+                finished[book_name] = entry
+
+    # 书单中的URL在后台并发下载，与书籍处理同时进行（并行模式下由各工作进程自行下载）
+    if args.workers <= 1:
+        start_downloads([path for name, path in book_dict.items() if is_url(path) and name not in finished], args)
+
+    if args.workers > 1:
+        profiles = run_books_parallel(book_dict, params_dict, args, manifest, finished)
+    else:
+        profiles = {}
+        for book_name, file_path in tqdm(book_dict.items(), desc="处理书籍"):
+            if book_name in finished:
+                print(finished[book_name]['report'], end='')
+                profiles[book_name] = finished[book_name]['profile']
+            else:
+                report, outcome = process_book_captured(book_name, file_path, params_dict, args)
+                print(report, end='')
+                record_book(args, manifest, book_name, file_path, params_dict, report, **outcome)
+                profiles[book_name] = outcome['profile']
+
+    if args.profile_json:
+        save_profiles(args.profile_json, args.config_file, params_dict, profiles)
+
+    if args.token_ids:
+        print_corpus_statistics(book_dict, args)
+
+_downloads = {}  # URL → 后台下载的concurrent.futures.Future
+
+def start_downloads(urls, args):
+    """在后台线程的事件循环中并发下载URL（共享连接池，并发数受限），每个URL的结果可单独等待"""
+    if not urls:
+        return
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    session = make_download_session(args.download_concurrency)
+    async def make_semaphore():
+        return asyncio.Semaphore(args.download_concurrency)
+    semaphore = asyncio.run_coroutine_threadsafe(make_semaphore(), loop).result()
+    for url in dict.fromkeys(urls):
+        _downloads[url] = asyncio.run_coroutine_threadsafe(
+            download_url(url, session, semaphore, args.download_dir, args.download_retries), loop)
+
+def resolve_source(file_path, args):
+    """书单中的URL换成本地缓存路径（等待后台下载，或在当前进程中下载）；本地路径原样返回"""
+    if not is_url(file_path):
+        return file_path
+    future = _downloads.get(file_path)
+    if future is not None:
+        path, message = future.result()
+    else:
+        session = make_download_session(1)
+        path, message = asyncio.run(download_url(
+            file_path, session, asyncio.Semaphore(1), args.download_dir, args.download_retries))
+    if message:
+        print(message)
+    if path:
+        print(f"* 本地缓存: {path}")
+    return path
+
+def load_manifest(path):
+    """读取运行清单；不存在或已损坏时返回空清单"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get('books'), dict):
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {'books': {}}
+
+def local_source(file_path, args):
+    """书单中的路径对应的本地文件：URL为下载缓存中的路径，本地路径原样返回"""
+    return url_cache_path(file_path, args.download_dir) if is_url(file_path) else file_path
+
+def book_signature(file_path, params, args):
+    """
+    书籍的运行签名：源文件路径、大小、修改时间（URL为下载到本地的文件）、预处理参数，以及影响输出或报告的命令行参数
+    （流式处理与分块大小、token id文件、分阶段统计）；任一变化时续跑会重新处理该书
+    """
+    try:
+        stat = os.stat(local_source(file_path, args))
+        source = [stat.st_size, stat.st_mtime_ns]
+    except OSError:
+        source = None
+    options = {'stream': args.stream, 'chunk_size': args.chunk_size if args.stream else None,
+               'token_ids': args.token_ids, 'profile': args.profile}
+    return {'file_path': str(file_path), 'source': source, 'params': params, 'options': options}
+
+def record_book(args, manifest, book_name, file_path, params_dict, report, result=None, profile=None, status='done'):
+    """
+    在运行清单（args.manifest）中记录一本书的完成情况（报告、输出路径、统计与检查结果），并原子地写回磁盘；
+    清单无法写入时只输出警告，不影响书单中其他书籍的处理
+    """
+    manifest['books'][book_name] = {
+        'status': status,
+        'signature': book_signature(file_path, params_dict.get(book_name), args),
+        'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'processed_file': str(get_processed_path(local_source(file_path, args))) if result else None,
+        'result': result,
+        'report': report,
+        'profile': profile,
+    }
+    try:
+        Path(args.manifest).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{args.manifest}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, args.manifest)  # 中途被终止时不会留下写了一半的清单
+    except OSError as e:
+        print(f"警告：无法写入运行清单 {args.manifest}：{str(e)}（《{book_name}》的完成状态未记录，续跑时会重新处理）")
+
+def save_profiles(path, config_file, params_dict, profiles):
+    """将各书籍的分阶段统计写为JSON（书籍 → 参数与各步骤统计），便于跨运行、跨配置比较"""
+    data = {
+        'config_file': str(config_file),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'books': {
+            book_name: {'params': params_dict.get(book_name), 'stages': stages}
+            for book_name, stages in profiles.items() if stages is not None
+        },
+    }
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+def run_books_parallel(book_dict, params_dict, args, manifest=None, finished=None):
+    """
+    使用进程池并行处理书单：每本书（读取、预处理、保存、统计、检查）在独立进程中执行，
+    其报告输出被捕获后按配置顺序打印，与串行输出逐字节一致；单本书出错不影响其他书籍。
+    某本书使工作进程崩溃（如内存不足被杀死、段错误）时整个进程池失效，池中未完成的书籍
+    改为各自在单独的进程中重新处理（process_book_isolated），只有再次崩溃的那本书被记为失败。
+    返回各书籍的分阶段统计（未启用--profile时为None）。
+    若提供了运行清单，每本书一完成（按完成顺序，而非配置顺序）即记录，中断时已完成的书籍都可续跑；
+    finished中的书籍（续跑时已完成）不再处理，直接输出清单中的报告。
+    """
+    profiles, finished = {}, finished or {}
+    outcomes = {book_name: Future() for book_name in book_dict if book_name not in finished}
+    manifest_lock = threading.Lock()  # 完成回调在进程池的管理线程和重试线程中执行
+
+    def finish(book_name, report, outcome):
+        try:
+            if manifest is not None:
+                with manifest_lock:
+                    record_book(args, manifest, book_name, book_dict[book_name], params_dict, report, **outcome)
+        finally:  # 清单写入失败也不能让主线程一直等待
+            outcomes[book_name].set_result((report, outcome))
+
+    def crashed(book_name, e):
+        report = f"\n## 处理书籍：《{book_name}》\n错误：工作进程异常退出 - {str(e)[:50]}...\n"
+        finish(book_name, report, {'result': None, 'profile': None, 'status': 'failed'})
+
+    def settle(book_name, future, isolated=False):
+        try:
+            report, outcome = future.result()
+        except BrokenProcessPool as e:
+            if isolated:
+                crashed(book_name, e)
+            else:  # 进程池已失效，无法确定是哪本书导致的：各自隔离重试
+                isolate(book_name)
+        except Exception as e:
+            crashed(book_name, e)
         else:
-            params = params_dict[book_name]
-            print("* 预处理参数:")
-            for key, value in params.items():
-                print(f"  * {key}: {value}")
-            print()        
-
-        # 1. 读取数据内容
-        original_doc = fetch_gutenberg_text(file_path)
-        if not original_doc:
-            print(f"错误： 无法读取书籍内容，跳过处理")
-            continue    
-                
-        print("###1. 成功获取文本")
-        print(f"* 长度{len(original_doc)}字符")
-        
-        # 2. 执行预处理
-        processed_doc, lang = normalize_doc(
-            original_doc, **params     # **params 将字典解包为关键字参数         
+            finish(book_name, report, outcome)
+
+    def isolate(book_name):
+        future = retry.submit(process_book_isolated, book_name, book_dict[book_name], params_dict, args)
+        future.add_done_callback(lambda f: settle(book_name, f, isolated=True))
+
+    with ThreadPoolExecutor(max_workers=args.workers) as retry, \
+         ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for book_name in outcomes:
+            try:
+                future = executor.submit(process_book_captured, book_name, book_dict[book_name], params_dict, args)
+            except BrokenProcessPool:  # 提交过程中进程池已失效
+                isolate(book_name)
+            else:
+                future.add_done_callback(lambda f, book_name=book_name: settle(book_name, f))
+        for book_name in tqdm(book_dict, desc="处理书籍"):  # 只有输出按配置顺序
+            if book_name in finished:
+                print(finished[book_name]['report'], end='')
+                profiles[book_name] = finished[book_name]['profile']
+                continue
+            report, outcome = outcomes[book_name].result()
+            print(report, end='')
+            profiles[book_name] = outcome['profile']
+    return profiles
+
+def process_book_isolated(book_name, file_path, params_dict, args):
+    """在只有一个工作进程的进程池中处理单本书籍：该进程崩溃只影响这一本书（抛出BrokenProcessPool）"""
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(process_book_captured, book_name, file_path, params_dict, args).result()
+
+def process_book_captured(book_name, file_path, params_dict, args):
+    """
+    处理单本书籍并捕获其报告，返回 (报告文本, {'result', 'profile', 'status'})；
+    处理异常或没有结果（如下载失败、无法读取、未知语言）时status为'failed'，续跑时会重新处理，而不中断整个书单
+    """
+    buf = io.StringIO()
+    outcome = {'result': None, 'profile': None}
+    with redirect_stdout(buf):
+        try:
+            outcome['result'], outcome['profile'] = process_book(book_name, file_path, params_dict, args)
+        except Exception as e:
+            print(f"错误：处理书籍时发生异常 - {type(e).__name__}: {str(e)[:50]}...")
+    outcome['status'] = 'done' if outcome['result'] is not None else 'failed'
+    return buf.getvalue(), outcome
+
+def process_book(book_name, file_path, params_dict, args):
+    """
+    处理单本书籍并输出其报告（读取、预处理、保存、统计、检查）；
+    返回 (结果, 分阶段统计)：结果为统计与检查结果（无法处理时为None），未启用--profile时分阶段统计为None
+    """
+    print(f"\n## 处理书籍：《{book_name}》")
+    print(f"\n### 书籍路径和处理参数")
+    print(f"* 源文件路径: {file_path}")
+
+    # 获取预处理参数
+    if book_name not in params_dict:
+        print(f"警告: 未找到 {book_name} 的预处理参数，使用默认值")
+        params = {
+            "html_stripping": True,
+            "contraction_expansion": True,
+            "accented_char_removal": True,
+            "text_lower_case": True,
+            "text_lemmatization": True,
+            "special_char_removal": True,
+            "stopword_removal": True,
+            "remove_digits": False,
+            "zh_simplification": True,
+            "isDebug": False
+        }
+    else:
+        params = params_dict[book_name]
+        print("* 预处理参数:")
+        for key, value in params.items():
+            print(f"  * {key}: {value}")
+        print()        
+
+    file_path = resolve_source(file_path, args)
+    if not file_path:
+        print(f"错误： 无法读取书籍内容，跳过处理")
+        return None, None
+
+    if args.lemma_cache:
+        open_lemma_cache(args.lemma_cache)
+
+    # 查询预处理结果缓存
+    cache_key = None
+    if args.cache_dir:
+        cache_key = preprocess_cache_key(
+            file_path, cache_params(params, args),
+            code_files=(Assign1_func.__file__, util.__file__, *args.jieba_userdict))
+        cached = None if args.refresh or not cache_key else load_cached_result(args.cache_dir, cache_key)
+        if cached:
+            print_cached_book(book_name, file_path, cached, cache_key)
+            return cached, None
+
+    # 首次处理书籍时才检查/下载NLTK数据（缓存命中或空书单不需要）
+    ensure_nltk_data(offline=args.offline or None)
+    if args.jieba_cache or args.jieba_userdict:
+        init_jieba(args.jieba_cache, args.jieba_userdict)
+
+    profiler = StageProfiler() if args.profile else None
+    if args.stream:
+        lemma_before = lemma_cache_info()  # 计数在进程内累计，只报告本书的增量
+        result = process_book_stream(book_name, file_path, params, args.chunk_size, profiler, args.token_ids)
+        report_lemma_cache(params, lemma_before)
+    else:
+        result = process_book_full(book_name, file_path, params, profiler, args.token_ids)
+
+    if cache_key and result:
+        store_cached_result(args.cache_dir, cache_key, result, get_processed_path(file_path),
+                            token_id_paths=get_token_id_paths(file_path) if args.token_ids else None,
+                            max_bytes=args.cache_max_mb << 20)
+    return result, (profiler.records() if profiler else None)
+
+def cache_params(params, args=None):
+    """
+    规范化预处理参数用于计算缓存键：补全normalize_doc的默认值，
+    并去掉不影响输出的参数（调试输出、并行度、return_tokens）；
+    影响结果的命令行参数（流式处理及其分块大小、token id文件）一并计入，整篇与流式处理的结果不共用缓存，
+    --token_ids的缓存条目中同时保存token id文件
+    """
+    normalized = {
+        name: p.default for name, p in inspect.signature(normalize_doc).parameters.items()
+        if p.default is not inspect.Parameter.empty
+    }
+    normalized.update(params)
+    for name in ('isDebug', 'lemma_workers', 'zh_workers', 'lang', 'return_tokens'):
+        normalized.pop(name, None)
+    if args is not None:
+        normalized['_mode'] = {'stream': args.stream, 'chunk_size': args.chunk_size if args.stream else None,
+                               'token_ids': args.token_ids}
+    return normalized
+
+def print_cached_book(book_name, file_path, cached, cache_key):
+    """输出命中缓存的书籍报告，并从缓存恢复xxx-p.txt（及token id文件），报告顺序与首次处理时相同"""
+    print(f"* 命中预处理缓存：{cache_key[:12]}（源文件与预处理参数未变，跳过读取与预处理）")
+    print("###1. 成功获取文本")
+    print(f"* 长度{cached['length']}字符")
+    print("###2. 预处理完成")
+    print(f"* 语言：{cached['lang']}，处理后长度：{cached['processed_length']}字符")
+
+    print("###3. 结果输出存储")
+    new_path = get_processed_path(file_path)
+    try:
+        shutil.copyfile(cached['processed_file'], new_path)
+        print(f"✅ 预处理文本已保存至：{new_path}")
+    except Exception as e:
+        print(f"❌ 保存文件失败 {new_path}：{str(e)}")
+    if cached.get('token_id_files'):
+        restore_token_ids(file_path, cached['token_id_files'])
+
+    n, k = 10, 20
+    print_statistics(cached['top_n'], cached['longest_k'], n, k)
+
+    print(f"## 检查预处理结果：《{book_name}》")
+    print_errors(cached['errors'])
+
+def process_book_full(book_name, file_path, params, profiler=None, token_ids=False):
+    """整篇处理单本书籍：读取、预处理、保存、统计、检查；返回可缓存的结果，失败时返回None"""
+    # 1. 读取数据内容
+    original_doc = fetch_gutenberg_text(file_path)
+    if not original_doc:
+        print(f"错误： 无法读取书籍内容，跳过处理")
+        return
+            
+    print("###1. 成功获取文本")
+    print(f"* 长度{len(original_doc)}字符")
+    
+    # 2. 执行预处理
+    # 总是同时取得token列表（normalize_doc_tokens：normalize_doc支持return_tokens时由其返回，
+    # 否则对处理后的文本分词一次），后续统计和检查不再重复分词，与流式处理统计的是同样的token
+    # 若参数中含"segment_mode": true，中英混合文档按段落判定语言后分别处理
+    doc_params = dict(params)
+    doc_params.pop('segment_mode', None)  # 只用于选择处理方式，normalize_doc没有该参数
+    if params.get('segment_mode'):
+        normalize = normalize_doc_segments
+        doc_params['return_tokens'] = True
+    else:
+        normalize = normalize_doc_tokens
+    lemma_before = lemma_cache_info()  # 计数在进程内累计，只报告本书的增量
+    with profiler or nullcontext():
+        processed_doc, lang, tokens = normalize(
+            original_doc, **doc_params     # **doc_params 将字典解包为关键字参数         
         )
 
+    print("###2. 预处理完成")
+    print(f"* 语言：{lang}，处理后长度：{len(processed_doc)}字符")
+    report_lemma_cache(params, lemma_before)
+    print_profile(profiler)
+       
+    if lang == 'unknown' or not processed_doc:
+        print("错误: 跳过检查（未知语言或空文本）")
+        return
+
+    # 3. 结果输出存储
+    print("###3. 结果输出存储")
+    save_processed_text(file_path, processed_doc)  # 调用保存函数
+    if token_ids:
+        save_token_ids(file_path, [tokens])
+
+    # 4. 输出前10高频词及前20长的单词（已保存token id时由id数组向量化统计）
+    n, k = 10, 20
+    if token_ids:
+        top_n, longest_k = CorpusStatistics.from_token_files({book_name: file_path}).summarize(n=n, k=k)
+    else:
+        top_n, longest_k = get_statistics(tokens, n=n, k=k, lang=lang)
+    print_statistics(top_n, longest_k, n, k)
+
+    print(f"## 检查预处理结果：《{book_name}》")            
+    
+    # 获取原始文本和处理后文本
+    errors = test_preprocessed_text(processed_doc, lang, tokens=tokens) if processed_doc else []
+    print_errors(errors)
+
+    return {'lang': lang, 'length': len(original_doc), 'processed_length': len(processed_doc),
+            'top_n': top_n, 'longest_k': longest_k, 'errors': errors}
+
+def process_book_stream(book_name, file_path, params, chunk_size, profiler=None, token_ids=False):
+    """流式处理单本书籍：逐块读取、预处理、写出，并逐块累计统计与检查结果；返回可缓存的结果，失败时返回None"""
+    # 1. 扫描数据内容（编码、首尾标记、语言），不读入全文
+    info = scan_gutenberg_text(file_path, chunk_size=chunk_size)
+    if not info:
+        print(f"错误： 无法读取书籍内容，跳过处理")
+        return
+
+    print("###1. 成功获取文本")
+    print(f"* 长度{info['length']}字符")
+
+    lang = info['lang']
+    if lang == 'unknown':
         print("###2. 预处理完成")
-        print(f"* 语言：{lang}，处理后长度：{len(processed_doc)}字符")
-           
-        if lang == 'unknown' or not processed_doc:
-            print("错误: 跳过检查（未知语言或空文本）")
-            continue
-
-        # 3. 结果输出存储
-        print("###3. 结果输出存储")
-        save_processed_text(file_path, processed_doc)  # 调用保存函数
-
-        # 4. 输出前10高频词及前20长的单词
-        n, k = 10, 20
-        top_n, longest_k = get_statistics(processed_doc, n=n, k=k, lang=lang)
-        print(f"###4. 输出文本前{n}高频词和前{k}长的单词:")
-        print(f"* 前{n}高频词统计")
-        print("| 词语 | 出现频率 |")
-        print("|------|----------|")
-        for word, freq in top_n:
-            print(f"| {word} | {freq} |")
-        print()
-        
-        print(f"* 前{k}长词统计")
-        print("| 词语 | 长度 |")
-        print("|------|----------|")
-        for word, len_w in longest_k:
-            print(f"| {word} | {len_w} |")
+        print(f"* 语言：{lang}，处理后长度：0字符")
+        print("错误: 跳过检查（未知语言或空文本）")
+        return
+
+    # 2-3. 逐块预处理并写出，同时累计词频与检查结果
+    stats = TokenStatistics()
+    errors = []
+    writer = TokenIdWriter(file_path) if token_ids else None  # 每个段落块为一个文档
+    def observe(processed_chunks):
+        for chunk, tokens in processed_chunks:  # normalize_doc_stream同时产出token列表，不再重新分词
+            if writer:
+                if tokens:
+                    writer.add(tokens)
+            else:
+                stats.update(tokens)
+            for e in test_preprocessed_text(chunk, lang, tokens=tokens):
+                if e not in errors:
+                    errors.append(e)
+            yield chunk
+
+    chunks = iter_gutenberg_text(file_path, encoding=info['encoding'], chunk_size=chunk_size)
+    processed = normalize_doc_stream(chunks, lang=lang, **params)
+    with profiler or nullcontext(), writer or nullcontext():  # 流式处理时total包含读取、写出和逐块统计
+        processed_len = save_processed_stream(file_path, observe(processed), verbose=False)
+        if processed_len is None and writer:
+            writer.discard()  # xxx-p.txt未能保存，不写出与之不对应的token id文件
+
+    print("###2. 预处理完成")
+    print(f"* 语言：{lang}，处理后长度：{processed_len or 0}字符")
+    print_profile(profiler)
+
+    if not processed_len:
+        print("错误: 跳过检查（未知语言或空文本）")
+        return
+
+    print("###3. 结果输出存储")
+    print(f"✅ 预处理文本已保存至：{get_processed_path(file_path)}")
+    if writer:
+        print(f"✅ token id已保存至：{writer.paths['ids']}（词表{len(writer.index)}词，{writer.offsets[-1]}个token）")
+
+    # 4. 输出前10高频词及前20长的单词
+    n, k = 10, 20
+    if writer:
+        stats = CorpusStatistics.from_token_files({book_name: file_path})
+    top_n, longest_k = stats.summarize(n=n, k=k)
+    print_statistics(top_n, longest_k, n, k)
+
+    print(f"## 检查预处理结果：《{book_name}》")
+    print_errors(errors)
+
+    return {'lang': lang, 'length': info['length'], 'processed_length': processed_len,
+            'top_n': top_n, 'longest_k': longest_k, 'errors': errors}
+
+def report_lemma_cache(params, since=None):
+    """写回词形还原磁盘缓存；isDebug时输出缓存命中统计（since为处理本书前的lemma_cache_info()快照，只输出本书的增量）"""
+    flush_lemma_cache()
+    if params.get("isDebug"):
+        info = lemma_cache_info(since)
+        print(f"* 词形还原缓存：命中{info['hits']}次，未命中{info['misses']}次，"
+              f"磁盘命中{info['disk_hits']}次，WordNet调用{info['wordnet_calls']}次")
+
+def print_profile(profiler):
+    """输出预处理各步骤的性能统计表（未启用--profile时不输出）"""
+    if profiler:
+        print("* 预处理分阶段统计")
+        print(profiler.to_markdown())
         print()
 
-        print(f"## 检查预处理结果：《{book_name}》")            
-        
-        # 获取原始文本和处理后文本
-        errors = test_preprocessed_text(processed_doc, lang) if processed_doc else []
-        if not errors:
-            print("✅ 所有检查通过")
-        else:
-            print("❌ 错误：")
-            for e in errors:
-                print(f"- {e}")
+def print_statistics(top_n, longest_k, n, k):
+    """输出前n高频词和前k长词的Markdown表格"""
+    print(f"###4. 输出文本前{n}高频词和前{k}长的单词:")
+    print(f"* 前{n}高频词统计")
+    print("| 词语 | 出现频率 |")
+    print("|------|----------|")
+    for word, freq in top_n:
+        print(f"| {word} | {freq} |")
+    print()
+    
+    print(f"* 前{k}长词统计")
+    print("| 词语 | 长度 |")
+    print("|------|----------|")
+    for word, len_w in longest_k:
+        print(f"| {word} | {len_w} |")
+    print()
+
+def print_corpus_statistics(book_dict, args):
+    """由各书籍的token id文件汇总整个书单的统计（CorpusStatistics），不重新读取或分词"""
+    paths = {name: local_source(path, args) for name, path in book_dict.items()}
+    corpus = CorpusStatistics.from_token_files(paths)
+    if not corpus.books:
+        return
+
+    print("\n## 语料统计")
+    print("| 书籍 | token数 | 词型数 | 类符/形符比 | 只出现一次的词 |")
+    print("|------|---------|--------|-------------|----------------|")
+    for name in corpus.books + [None]:
+        info = corpus.summary(name)
+        print(f"| {name or '合计'} | {info['tokens']} | {info['types']} | {info['ttr']:.4f} | {info['hapax']} |")
+    print()
+
+    n = 10
+    top_n, _ = corpus.summarize(n=n, k=0)
+    print(f"* 语料前{n}高频词统计")
+    print("| 词语 | 出现频率 |")
+    print("|------|----------|")
+    for word, freq in top_n:
+        print(f"| {word} | {freq} |")
+    print()
+
+    if args.freq_matrix:
+        corpus.save(args.freq_matrix)
+        print(f"✅ 词频矩阵已保存至：{args.freq_matrix}（{len(corpus.books)}本书 × {len(corpus.vocab)}词）")
+
+def print_errors(errors):
+    """输出预处理结果检查"""
+    if not errors:
+        print("✅ 所有检查通过")
+    else:
+        print("❌ 错误：")
+        for e in errors:
+            print(f"- {e}")
 
 if __name__ == "__main__":
     # 执行主函数
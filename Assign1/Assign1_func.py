@@ -4,29 +4,75 @@
 # @Last Modified by:   Haiqin Yang
 # @Last Modified time: 2025-10-07 17:03:41
 import nltk
-nltk.download('punkt')
-nltk.download('wordnet')
-nltk.download('stopwords')
-nltk.download('averaged_perceptron_tagger')
-nltk.download('averaged_perceptron_tagger_eng')
 
 from nltk.stem import PorterStemmer
 
 from nltk.corpus import wordnet, stopwords
 
 from nltk.stem import WordNetLemmatizer
-wnl = WordNetLemmatizer()
+import atexit
+import inspect
+import os
 import re
+import sqlite3
+import time
+import tracemalloc
 import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import contractions
-from bs4 import BeautifulSoup
-import jieba  # 中文分词
-from opencc import OpenCC  # 中文繁体转简体
-from util import detect_language # 导入需要的函数
+from util import detect_language, tokenize_text, get_stopwords, LazyResource, lazy_import # 导入需要的函数
 
-# 初始化工具
-wnl = WordNetLemmatizer()
-cc_zh = OpenCC('t2s')  # 中文繁体转简体
+# 初始化工具（首次使用时才导入/创建，只处理英文或只处理中文时不会加载另一种语言的工具）
+BeautifulSoup = lazy_import('bs4', 'BeautifulSoup')
+jieba = lazy_import('jieba')  # 中文分词
+OpenCC = lazy_import('opencc', 'OpenCC')  # 中文繁体转简体
+wnl = LazyResource(WordNetLemmatizer)
+cc_zh = LazyResource(lambda: OpenCC('t2s'))  # 中文繁体转简体
+
+# 需要的NLTK数据：下载名 → nltk.data中的资源路径
+NLTK_RESOURCES = {
+    'punkt': 'tokenizers/punkt',
+    'punkt_tab': 'tokenizers/punkt_tab',  # nltk>=3.9的word_tokenize使用
+    'wordnet': 'corpora/wordnet',
+    'stopwords': 'corpora/stopwords',
+    'averaged_perceptron_tagger': 'taggers/averaged_perceptron_tagger',
+    'averaged_perceptron_tagger_eng': 'taggers/averaged_perceptron_tagger_eng',
+}
+_nltk_checked = set()
+
+def ensure_nltk_data(names=None, offline=None):
+    """
+    检查NLTK数据是否已在本地，只下载缺失的部分（代替导入时无条件调用nltk.download）。
+    
+    参数：
+        names (iterable, optional)：需要的资源名（NLTK_RESOURCES的键），默认全部。
+        offline (bool, optional)：离线模式，只检查本地数据、从不访问网络；
+                                  为None时由环境变量NLTK_OFFLINE决定（如NLTK_OFFLINE=1）。
+    
+    返回：
+        list：仍然缺失的资源名（离线模式或下载失败时非空）。
+    
+    示例：
+        >>> ensure_nltk_data(['stopwords'], offline=True)
+        []
+    """
+    if offline is None:
+        offline = os.environ.get('NLTK_OFFLINE', '') not in ('', '0')
+    missing = []
+    for name in (NLTK_RESOURCES if names is None else names):
+        if name in _nltk_checked:
+            continue
+        try:
+            nltk.data.find(NLTK_RESOURCES[name])
+        except LookupError:
+            if offline or not nltk.download(name, quiet=True):
+                missing.append(name)
+                continue
+        _nltk_checked.add(name)
+    if missing:
+        print(f"警告：缺少NLTK数据 {missing}，请联网运行或执行 nltk.download() 下载")
+    return missing
 
 def strip_html_tags(text):
     """
@@ -120,7 +166,8 @@ def lemmatize_text(text):
         1. 分词：将文本拆分为独立词语（使用NLTK的`word_tokenize`）。
         2. 词性标注：为每个词语添加Penn Treebank格式的词性标签（使用NLTK的`pos_tag`）。
         3. 标签转换：将词性标签转换为WordNet兼容格式（调用`pos_tag_wordnet`）。
-        4. 词形还原：使用WordNet词形还原器，根据转换后的词性标签对每个词语进行还原。
+        4. 词形还原：使用WordNet词形还原器，根据转换后的词性标签对每个词语进行还原
+           （可调用带缓存的`lemmatize_word(word, pos)`代替`wnl.lemmatize(word, pos)`）。
         5. 拼接：将还原后的词语重新拼接为文本。
     
     参数：
@@ -140,6 +187,106 @@ def lemmatize_text(text):
     """
     pass       
 
+# 词形还原缓存：自然文本服从Zipf分布，少量(词, 词性)组合占据绝大多数调用
+LEMMA_CACHE_SIZE = 200000   # 进程内LRU缓存的最大条目数
+_lemma_db = None            # 可选的磁盘缓存（sqlite），由open_lemma_cache打开
+_lemma_db_path = None
+_lemma_db_readonly = False
+_lemma_pending = []         # 待写入磁盘缓存的新条目
+_lemma_counts = {'disk_hits': 0, 'wordnet_calls': 0}
+_lemma_worker_counts = {'hits': 0, 'misses': 0, 'disk_hits': 0, 'wordnet_calls': 0}  # _lemmatize_tokens_parallel各工作进程的计数
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize_word(word, pos='n'):
+    """
+    带缓存的`wnl.lemmatize(word, pos)`：先查进程内LRU缓存，再查磁盘缓存，最后才调用WordNet。
+    
+    参数：
+        word (str)：待还原的词语。
+        pos (str)：WordNet词性标签（如`pos_tag_wordnet`返回的`wordnet.VERB`），默认名词'n'。
+    
+    返回：
+        str：词语的基本形式，与`wnl.lemmatize(word, pos)`一致。
+    
+    示例：
+        >>> lemmatize_word('running', wordnet.VERB)
+        'run'
+    """
+    if _lemma_db is not None:
+        row = _lemma_db.execute(
+            'SELECT lemma FROM lemmas WHERE word = ? AND pos = ?', (word, pos)).fetchone()
+        if row is not None:
+            _lemma_counts['disk_hits'] += 1
+            return row[0]
+
+    lemma = wnl.lemmatize(word, pos)
+    _lemma_counts['wordnet_calls'] += 1
+    if _lemma_db is not None and not _lemma_db_readonly:
+        _lemma_pending.append((word, pos, lemma))
+        if len(_lemma_pending) >= 1000:
+            flush_lemma_cache()
+    return lemma
+
+def open_lemma_cache(path, readonly=False):
+    """
+    打开（或创建）磁盘上的词形还原缓存，重复运行时可跳过几乎所有WordNet查询。
+    
+    参数：
+        path (str)：sqlite数据库文件路径，如 './data/lemma_cache.db'。
+        readonly (bool)：只读打开（供并行工作进程使用，新条目不写回）。
+    """
+    global _lemma_db, _lemma_db_path, _lemma_db_readonly
+    if _lemma_db is not None and (_lemma_db_path, _lemma_db_readonly) == (path, readonly):
+        return  # 已打开
+    close_lemma_cache()
+    if readonly:
+        _lemma_db = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    else:
+        _lemma_db = sqlite3.connect(path, timeout=30)
+        _lemma_db.execute(
+            'CREATE TABLE IF NOT EXISTS lemmas ('
+            'word TEXT NOT NULL, pos TEXT NOT NULL, lemma TEXT NOT NULL, PRIMARY KEY (word, pos))')
+        _lemma_db.commit()
+    _lemma_db_path, _lemma_db_readonly = path, readonly
+
+def flush_lemma_cache():
+    """将新还原的条目写入磁盘缓存"""
+    if _lemma_db is None or _lemma_db_readonly or not _lemma_pending:
+        return
+    _lemma_db.executemany('INSERT OR IGNORE INTO lemmas VALUES (?, ?, ?)', _lemma_pending)
+    _lemma_db.commit()
+    _lemma_pending.clear()
+
+def close_lemma_cache():
+    """写回未保存的条目并关闭磁盘缓存"""
+    global _lemma_db, _lemma_db_path
+    if _lemma_db is None:
+        return
+    flush_lemma_cache()
+    _lemma_db.close()
+    _lemma_db = _lemma_db_path = None
+
+def lemma_cache_info(since=None):
+    """
+    返回词形还原缓存的命中统计，供isDebug时打印。计数在进程内累计，
+    包括本进程调用的_lemmatize_tokens_parallel在工作进程中的查询。
+    
+    参数：
+        since (dict, optional)：之前的lemma_cache_info()快照；给出时返回此后的增量
+                                （如只统计一本书），size仍为当前条目数。
+    
+    返回：
+        dict：hits/misses为进程内LRU的命中/未命中次数，disk_hits为磁盘缓存命中次数，
+              wordnet_calls为实际调用WordNet的次数，size为本进程LRU当前条目数。
+    """
+    info = lemmatize_word.cache_info()
+    counts = {'hits': info.hits, 'misses': info.misses, **_lemma_counts}
+    for key, value in _lemma_worker_counts.items():
+        counts[key] += value
+    if since:
+        counts = {key: value - since.get(key, 0) for key, value in counts.items()}
+    return {**counts, 'size': info.currsize}
+
 def remove_special_characters(text, lang='en', remove_digits=False):
     """
     移除文本中的特殊字符（如标点符号、符号等），可选择是否保留数字。
@@ -178,6 +325,102 @@ def remove_special_characters(text, lang='en', remove_digits=False):
     """
     pass
 
+# 字符级步骤的快速路径：每种(lang, remove_digits, accent, lower)组合只构建一次转换表/正则，
+# 并将重音移除、小写转换、特殊字符移除合并为一次遍历
+@lru_cache(maxsize=None)
+def special_char_pattern(lang='en', remove_digits=False):
+    """
+    返回remove_special_characters所用的预编译正则（匹配需要移除的连续字符），按参数组合缓存。
+    
+    示例：
+        >>> special_char_pattern('en').sub('', "Hello, world! 123")
+        'Hello world 123'
+    """
+    if lang == 'en':
+        allowed = r'a-zA-Z\s' if remove_digits else r'a-zA-Z0-9\s'
+    elif lang == 'zh':
+        allowed = r'\u4e00-\u9fa5\s' if remove_digits else r'\u4e00-\u9fa50-9\s'
+    else:
+        raise ValueError("Unsupported language. Use 'en' or 'zh'.")
+    return re.compile(f'[^{allowed}]+')
+
+_NON_ASCII_RUN = re.compile(r'[^\x00-\x7f]+')
+
+class _CharMap(dict):
+    """非ASCII字符的转换表（str.translate使用），首次遇到某字符时计算并缓存其结果"""
+    def __init__(self, convert):
+        super().__init__()
+        self.convert = convert
+
+    def __missing__(self, code):
+        self[code] = self.convert(chr(code))
+        return self[code]
+
+@lru_cache(maxsize=None)
+def char_normalizer(lang='en', remove_digits=False, accent=True, lower=True, special=True):
+    """
+    返回一个函数f(text)，一次遍历完成以下字符级步骤（结果与依次执行相同）：
+        accent：remove_accented_chars（NFKD分解后只保留ASCII字符，仅英文）；
+        lower：转为小写（仅英文）；
+        special：按special_char_pattern(lang, remove_digits)移除特殊字符（不处理多余空白）。
+    转换表按参数组合缓存。英文时ASCII字符由bytes.translate一次完成小写与删除，
+    非ASCII字符（英文书中很少）逐字符查表转换；中文时只需一次预编译正则替换。
+    只做重音移除与小写转换（special=False，如normalize_chars）时，整段NFKD后小写。
+    
+    适用于不做词形还原的英文文本或中文文本；做词形还原时，可先用accent、lower合并的函数，
+    还原后再用special_char_pattern移除特殊字符。
+    
+    示例：
+        >>> char_normalizer('en')("Café Crème, 2½ cups!")
+        'cafe creme 212 cups'
+    """
+    if lang == 'zh':
+        pattern = special_char_pattern(lang, remove_digits)
+        return (lambda text: pattern.sub('', text)) if special else (lambda text: text)
+    if lang != 'en':
+        raise ValueError("Unsupported language. Use 'en' or 'zh'.")
+    if not (accent or special):  # 只有小写转换（非ASCII字符的小写与上下文有关，如希腊字母Σ）
+        return (lambda text: text.lower()) if lower else (lambda text: text)
+    if not special:  # 重音移除后只剩ASCII字符，整段NFKD（C实现，纯ASCII文本几乎不耗时）比逐字符查表快
+        def fold(text):
+            text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+            return text.lower() if lower else text
+        return fold
+
+    pattern = special_char_pattern(lang, remove_digits)
+    def convert(char):
+        if accent:
+            char = unicodedata.normalize('NFKD', char).encode('ascii', 'ignore').decode('ascii')
+        if lower:
+            char = char.lower()
+        return pattern.sub('', char) if special else char
+    char_map = _CharMap(convert)
+    upper = bytes(range(ord('A'), ord('Z') + 1))
+    table = bytes.maketrans(upper, upper.lower()) if lower else None
+    delete = bytes(b for b in range(128) if pattern.match(chr(b))) if special else b''
+
+    def normalize(text):
+        if not text.isascii():
+            text = _NON_ASCII_RUN.sub(lambda m: m.group().translate(char_map), text)
+        # 非ASCII字符的UTF-8字节均不小于0x80，不受ASCII转换表影响
+        return text.encode('utf-8', 'surrogatepass').translate(table, delete).decode('utf-8', 'surrogatepass')
+    return normalize
+
+def fold_accents(text, lower=True):
+    """
+    英文的重音字符移除（lower=True时同时转为小写），由char_normalizer合并为一次遍历；
+    normalize_chars按名称调用，--profile时计入accented_char_removal步骤。
+    
+    示例：
+        >>> fold_accents("Café Crème")
+        'cafe creme'
+    """
+    return char_normalizer('en', accent=True, lower=lower, special=False)(text)
+
+def lower_case(text):
+    """英文的小写转换（不移除重音字符时）；normalize_chars按名称调用，--profile时计入text_lower_case步骤"""
+    return char_normalizer('en', accent=False, lower=True, special=False)(text)
+
 def remove_stopwords(text, is_lower_case=False, stopwords=None, lang='en'):
     """
     移除文本中的停用词（如英文的"the"、"is"，中文的"的"、"了"等无实际语义的高频词），支持中英文。
@@ -188,7 +431,7 @@ def remove_stopwords(text, is_lower_case=False, stopwords=None, lang='en'):
            - 中文：使用NLTK的中文停用词表（nltk.corpus.stopwords.words('chinese')）。
         2. 分词：根据语言选择分词工具：
            - 英文：使用NLTK的`word_tokenize`进行分词。
-           - 中文：使用Jieba的`lcut`（精确模式）进行分词。
+           - 中文：使用Jieba的`lcut`（精确模式）进行分词（长文本可用`util.segment_zh`多进程分词）。
         3. 过滤停用词：根据`is_lower_case`判断是否需要将词语小写后再匹配停用词表，保留非停用词。
         4. 拼接：将过滤后的词语重新拼接为文本。
     
@@ -214,6 +457,180 @@ def remove_stopwords(text, is_lower_case=False, stopwords=None, lang='en'):
         '只 敏捷 棕色 狐狸 跳过 只 懒 狗'
     """
     pass    
+
+# 基于token列表的处理步骤：整篇只分词一次，后续步骤在token上进行，不再拼接后重新切分
+def lemmatize_tokens(tokens):
+    """
+    对已分词的英文token列表做词形还原（与lemmatize_text相同的标注与还原，但跳过分词）。
+    
+    参数：
+        tokens (list)：token列表，如`tokenize_text(text, 'en')`的结果。
+    
+    返回：
+        list：还原后的token列表，与输入一一对应。
+    
+    示例：
+        >>> lemmatize_tokens(['cats', 'are', 'running'])
+        ['cat', 'be', 'run']
+    """
+    return [lemmatize_word(word, pos) for word, pos in pos_tag_wordnet(nltk.pos_tag(tokens))]
+
+STREAM_CONTEXT_TOKENS = 32  # lemmatize_tokens_in_context初始的左上下文词数（约一句）
+_context_tagger = LazyResource(lambda: nltk.tag.PerceptronTagger())  # 与nltk.pos_tag使用的标注器相同，只加载一次
+
+def lemmatize_tokens_in_context(tokens, left=(), right=(), workers=1):
+    """
+    带上下文的lemmatize_tokens：tokens是整篇token序列中的一段（如流式处理的一块），
+    left为其前文已确定标签的 (词, 标签) 列表，right为其后紧接的词（至多用到两个）。
+    
+    词性标注器（平均感知机，贪心地从左到右标注）对每个词的特征只依赖前后各两个词和前两个词的预测标签，
+    因此取left末尾约一句（STREAM_CONTEXT_TOKENS个词）与tokens、right一起标注，只保留tokens的标签：
+    若上下文最后两个词的标签与left中的相同，则tokens的标签与整篇标注时完全相同；否则加倍左上下文
+    重新标注，直至标签一致。left为整篇前文时总是一致；
+    流式处理只保留前一块，标注器通常几个词内即与整篇标注重合，前一块内仍不一致的情况实际不会出现。
+    
+    参数：
+        tokens (list)：待还原的英文token列表。
+        left (list)：前文的 (词, Penn Treebank标签) 列表，文首为空。
+        right (list)：后文的token，文末为空。
+        workers (int)：进程数，默认1；大于1时由_lemmatize_tokens_parallel将tokens分片后在进程池中
+                       标注与还原（每个进程只加载一次词性标注器和WordNet），结果与workers=1一致。
+    
+    返回：
+        元组 (lemmas, tagged)：还原后的token列表（与tokens一一对应），以及tokens的 (词, 标签) 列表
+        （可作为下一段的left）。
+    
+    示例：
+        >>> lemmas, tagged = lemmatize_tokens_in_context(['are', 'running'], left=[('cats', 'NNS')])
+        >>> lemmas
+        ['be', 'run']
+    """
+    left, right = list(left), list(right)[:2]  # 标注特征只用到后两个词
+    if workers > 1 and len(tokens) >= 2 * LEMMA_SHARD_TOKENS:
+        return _lemmatize_tokens_parallel(list(tokens), left, right, workers)
+    n = min(len(left), STREAM_CONTEXT_TOKENS)
+    while True:
+        context = left[len(left) - n:]
+        tagged = _context_tagger.tag([word for word, _ in context] + list(tokens) + right)
+        if n == len(left) or [tag for _, tag in tagged[max(0, n - 2):n]] == [tag for _, tag in context[-2:]]:
+            break
+        n = min(len(left), n * 2)
+    tagged = tagged[n:n + len(tokens)]
+    return [lemmatize_word(word, pos) for word, pos in pos_tag_wordnet(tagged)], tagged
+
+# 并行词形还原：每个工作进程只加载一次词性标注器和WordNet
+LEMMA_SHARD_TOKENS = 1024  # 并行时每个分片的最少token数，更短的序列直接在本进程中处理
+_lemma_pools = {}  # (进程数, 磁盘缓存路径) → ProcessPoolExecutor
+_worker_tagger = None
+
+def _lemmatize_tokens_parallel(tokens, left, right, workers):
+    """
+    lemmatize_tokens_in_context的多进程实现：
+        1. 将tokens按token数均分为约workers*4个连续分片，便于负载均衡。
+        2. 每个分片带上其前STREAM_CONTEXT_TOKENS个词（分片之前的tokens或left中的词）作为左上下文、
+           其后两个词作为右上下文，在进程池中标注，只保留分片本身的标签并逐词还原。
+        3. 主进程按顺序校验：若分片左上下文最后两个词的标签与前面已确定的（与串行一致的）标签相同，
+           则该分片的标签与串行标注完全相同；否则在本进程中以已确定的前文为left重新处理该分片。
+    进程池按进程数和当前磁盘缓存路径缓存复用（open_lemma_cache换了路径时重新创建，旧的进程池被关闭），
+    退出时由shutdown_lemma_pools关闭。
+    """
+    n_shards = min(workers * 4, len(tokens) // LEMMA_SHARD_TOKENS)
+    bounds = [len(tokens) * k // n_shards for k in range(n_shards + 1)]
+    words = [word for word, _ in left[-STREAM_CONTEXT_TOKENS:]] + tokens + right
+    offset = len(words) - len(tokens) - len(right)  # tokens在words中的起始位置
+    shards = [(words[max(0, offset + lo - STREAM_CONTEXT_TOKENS):offset + lo],
+               tokens[lo:hi],
+               words[offset + hi:offset + hi + 2]) for lo, hi in zip(bounds, bounds[1:])]
+
+    pool = _lemma_pools.get((workers, _lemma_db_path))
+    if pool is None:
+        # 工作进程在初始化时打开磁盘缓存，缓存路径变化后旧进程池中的进程不会看到新路径
+        for key in [key for key in _lemma_pools if key[1] != _lemma_db_path]:
+            _lemma_pools.pop(key).shutdown()
+        pool = _lemma_pools[workers, _lemma_db_path] = ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_lemma_worker, initargs=(_lemma_db_path,))
+
+    lemmas, tagged = [], []
+    for (context, shard, shard_right), (context_tail, shard_tagged, shard_lemmas, counts) in zip(
+            shards, pool.map(_lemmatize_shard, shards)):
+        for key in _lemma_worker_counts:  # 工作进程中的缓存查询计入本进程的lemma_cache_info
+            _lemma_worker_counts[key] += counts[key]
+        exact = left + tagged  # 已确定的前文标签
+        if len(context) < len(exact) and context_tail != [tag for _, tag in exact[-2:]]:
+            shard_lemmas, shard_tagged = lemmatize_tokens_in_context(shard, exact, shard_right)
+        lemmas += shard_lemmas
+        tagged += shard_tagged
+    return lemmas, tagged
+
+def shutdown_lemma_pools():
+    """关闭_lemmatize_tokens_parallel缓存的所有进程池（进程退出时自动调用）"""
+    while _lemma_pools:
+        _lemma_pools.popitem()[1].shutdown()
+
+atexit.register(shutdown_lemma_pools)
+
+def _init_lemma_worker(lemma_db_path=None):
+    """
+    工作进程初始化：加载词性标注器，并预热WordNet（首次lemmatize时才会加载词典）；
+    若主进程打开了磁盘缓存，则以只读方式重新打开（sqlite连接不能跨进程共享）。
+    """
+    global _worker_tagger, _lemma_db
+    _worker_tagger = nltk.tag.PerceptronTagger()
+    wnl.lemmatize('cats')
+    _lemma_db = None
+    _lemma_pending.clear()
+    if lemma_db_path:
+        open_lemma_cache(lemma_db_path, readonly=True)
+
+def _lemmatize_shard(shard):
+    """
+    对一个分片（左上下文词, 分片词, 右上下文词）标注并还原；
+    返回 (左上下文最后两个词的标签, 分片的 (词, 标签) 列表, 还原后的分片token列表,
+          本分片的缓存计数增量lemma_cache_info(since=...))
+    """
+    before = lemma_cache_info()
+    context, tokens, right = shard
+    tagger = _worker_tagger or _context_tagger
+    tagged = tagger.tag(context + tokens + right)
+    context_tail = [tag for _, tag in tagged[:len(context)][-2:]]
+    tagged = tagged[len(context):len(context) + len(tokens)]
+    lemmas = [lemmatize_word(word, pos) for word, pos in pos_tag_wordnet(tagged)]
+    return context_tail, tagged, lemmas, lemma_cache_info(since=before)
+
+def remove_special_tokens(tokens, lang='en', remove_digits=False):
+    """
+    逐token移除特殊字符（规则同remove_special_characters，使用按参数缓存的special_char_pattern），
+    移除后为空的token被丢弃。
+    
+    示例：
+        >>> remove_special_tokens(['hello', ',', "n't", '123'], lang='en', remove_digits=True)
+        ['hello', 'nt']
+    """
+    pattern = special_char_pattern(lang, remove_digits)
+    cleaned = (pattern.sub('', token).strip() for token in tokens)
+    return [token for token in cleaned if token]
+
+def remove_stopwords_tokens(tokens, is_lower_case=False, stopwords=None, lang='en'):
+    """
+    从token列表中移除停用词（规则同remove_stopwords，但不再分词和拼接）。
+    
+    参数：
+        tokens (list)：token列表。
+        is_lower_case (bool)：token是否已转为小写，默认False（需将token小写后再匹配停用词）。
+        stopwords (list, optional)：自定义停用词表，若为None则使用util.get_stopwords(lang)的默认表。
+        lang (str)：语言类型，'en'（英文）或'zh'（中文），默认'en'。
+    
+    返回：
+        list：移除停用词后的token列表。
+    
+    示例：
+        >>> remove_stopwords_tokens(['The', 'quick', 'fox', 'is', 'lazy'], lang='en')
+        ['quick', 'fox', 'lazy']
+    """
+    stopwords = get_stopwords(lang) if stopwords is None else set(stopwords)
+    if is_lower_case:
+        return [token for token in tokens if token not in stopwords]
+    return [token for token in tokens if token.lower() not in stopwords]
  
 def normalize_doc(doc, 
                      html_stripping=True, 
@@ -225,10 +642,16 @@ def normalize_doc(doc,
                      stopword_removal=True, 
                      remove_digits=False, # Default: keep digits
                      zh_simplification=True,
-                     isDebug=False):
+                     isDebug=False,
+                     lang=None,
+                     lemma_workers=1,
+                     zh_workers=1,
+                     return_tokens=False):
     """
     规范化文本语料库，支持多种预处理操作，包括HTML标签移除、缩写扩展、重音字符移除、
     小写转换、词形还原、特殊字符移除、停用词移除等，适用于中英文文本。
+    步骤顺序：normalize_chars（分词前的字符级步骤）→ 词形还原 → 特殊字符移除 → 停用词移除；
+    return_tokens=True时分词后的步骤由normalize_tokens完成（normalize_docs使用相同的两段）。
     参数：
         doc (str): 输入文档。
         html_stripping (bool): 是否移除HTML标签，默认True。
@@ -240,10 +663,429 @@ def normalize_doc(doc,
         stopword_removal (bool): 是否移除停用词，默认True。
         remove_digits (bool): 是否移除数字，默认False。
         zh_simplification (bool): 是否将中文繁体转换为简体，默认True。
-        isDebug (bool): 是否打印调试信息，默认False。
+        isDebug (bool): 是否打印调试信息，默认False；词形还原后可打印`lemma_cache_info()`查看缓存命中情况。
+        lang (str, optional): 已知的文本语言（'en'/'zh'）；为None时由detect_language检测，
+                              流式处理时由调用方对整篇文本检测一次后传入，保证各块语言一致。
+        lemma_workers (int): 词形还原的进程数，默认1；return_tokens=True时可用
+                             `lemmatize_tokens_in_context(tokens, workers=lemma_workers)[0]`代替lemmatize_tokens，
+                             大于1时分片后多进程标注与还原，结果与串行一致（--stream的英文词形还原已使用该参数）。
+        zh_workers (int): 中文分词的进程数，默认1；大于1时用util.segment_zh(text, workers=zh_workers)
+                          代替jieba.lcut(text)，按句末标点分批并行分词，结果与串行一致。
+        return_tokens (bool): 是否同时返回token列表，默认False。为True时整篇只分词一次
+                              （util.tokenize_text），之后的词形还原、特殊字符移除、停用词移除
+                              使用lemmatize_tokens、remove_special_tokens、remove_stopwords_tokens在token上进行。
     返回：
         元组 `(doc, lang)`，其中：
             - doc (str)：预处理后的文本(切词后用空格相连)
             - lang (str)：文本语言（'en'/'zh'/'unknown'）    
+        若return_tokens=True，返回 `(doc, lang, tokens)`，tokens为预处理后的token列表，
+        可直接传给util.get_statistics和util.test_preprocessed_text，避免再次分词。
     """                              
     pass
+
+def normalize_doc_tokens(doc, lang=None, **params):
+    """
+    调用normalize_doc并总是返回 `(doc, lang, tokens)`，供Assign1.py、normalize_doc_stream和
+    normalize_doc_segments使用。兼容按原始约定实现的normalize_doc：签名中没有lang或return_tokens参数时不传入
+    （由normalize_doc自行检测语言），只返回 `(doc, lang)` 时由util.tokenize_text对处理后的文本分词。
+    
+    参数：
+        doc (str)：输入文档。
+        lang (str, optional)：已知的文本语言，normalize_doc接受lang参数时传入。
+        **params：传给normalize_doc的预处理参数（return_tokens会被忽略）。
+    返回：
+        元组 `(doc, lang, tokens)`；语言为'unknown'或处理后为空时tokens为[]。
+    """
+    params.pop('return_tokens', None)
+    accepted = inspect.signature(normalize_doc).parameters
+    extra = {'lang': lang, 'return_tokens': True}
+    if not any(p.kind == p.VAR_KEYWORD for p in accepted.values()):
+        extra = {name: value for name, value in extra.items() if name in accepted}
+    processed, doc_lang, *rest = normalize_doc(doc, **params, **extra)
+    if rest:
+        return processed, doc_lang, rest[0]
+    if doc_lang not in ('en', 'zh') or not processed:
+        return processed, doc_lang, []
+    return processed, doc_lang, tokenize_text(processed, doc_lang, workers=params.get('zh_workers', 1))
+
+def normalize_doc_stream(chunks, lang=None, **params):
+    """
+    流式规范化：对按段落切分的文本块逐块处理（normalize_doc_tokens），内存占用只与单块大小有关。
+    
+    参数：
+        chunks (iterable)：文本块，如util.iter_gutenberg_text的输出。
+        lang (str, optional)：整篇文本的语言（如util.scan_gutenberg_text返回的'lang'），
+                              为None时逐块检测（短块可能被判为'unknown'）。
+        **params：传给normalize_doc的预处理参数（return_tokens会被忽略）。
+    返回：
+        生成器：逐块产出 `(processed, tokens)`：预处理后的文本（切词后用空格相连）及其token列表，
+        统计和检查直接使用tokens，不再重新分词；语言为'unknown'的块被跳过。
+        各块文本以空格相连（如util.save_processed_stream）输出整篇结果，与整篇处理时设置
+        return_tokens=True的结果对应。块在段落边界切分，不做词形还原时逐块调用normalize_doc，与整篇处理一致。
+        lang='en'且做词形还原时，各块由normalize_chars → 分词 → lemmatize_tokens_in_context → normalize_tokens
+        处理（同normalize_docs的token路径，lemma_workers大于1时各块分片后多进程标注与还原）：每块带上前一块末尾的词作为左上下文、
+        后一块开头的两个词作为右上下文一起标注词性，再去掉上下文，标签与整篇标注一致（见lemmatize_tokens_in_context）。
+    """
+    params.pop('segment_mode', None)  # 流式处理时整篇语言已确定，不再按段落路由
+    params.pop('return_tokens', None)
+    if lang == 'en' and params.get('text_lemmatization', True):
+        yield from _normalize_stream_in_context(chunks, params)
+        return
+    for chunk in chunks:
+        processed, chunk_lang, tokens = normalize_doc_tokens(chunk, lang=lang, **params)
+        if chunk_lang == 'unknown' or not processed:
+            continue
+        yield processed, tokens
+
+def _normalize_stream_in_context(chunks, params):
+    """normalize_doc_stream的英文词形还原路径：缓存下一块的开头作为右上下文，逐块带上下文标注后产出"""
+    inspect.signature(_normalize_batch).bind(None, **params)  # 未知的参数立即引发TypeError（同normalize_docs）
+    char_params = {name: params[name] for name in inspect.signature(normalize_chars).parameters if name in params}
+    token_params = {name: params[name] for name in inspect.signature(normalize_tokens).parameters if name in params}
+
+    workers = params.get('lemma_workers', 1)
+
+    def finish(tokens, right):
+        nonlocal left
+        lemmas, tagged = lemmatize_tokens_in_context(tokens, left, right, workers=workers)
+        left = (left + tagged)[-max(len(tagged), STREAM_CONTEXT_TOKENS * 4):]  # 块很短时保留更早的前文
+        tokens = normalize_tokens(lemmas, 'en', **token_params)
+        return ' '.join(tokens), tokens
+
+    left, pending = [], []  # left：前一块已确定标签的 (词, 标签)；pending：等待右上下文的块的token列表
+    for chunk in chunks:
+        tokens = tokenize_text(normalize_chars(chunk, 'en', **char_params), 'en')
+        if not tokens:
+            continue
+        pending.append(tokens)
+        # 后面的块合起来至少有两个词时，最前面的块即可标注
+        while len(pending) > 1 and sum(len(t) for t in pending[1:]) >= 2:
+            right = [token for t in pending[1:] for token in t][:2]
+            processed, tokens = finish(pending.pop(0), right)
+            if processed:
+                yield processed, tokens
+    while pending:  # 文末各块：右侧没有（足够的）后文
+        right = [token for t in pending[1:] for token in t][:2]
+        processed, tokens = finish(pending.pop(0), right)
+        if processed:
+            yield processed, tokens
+
+def normalize_doc_segments(doc, **params):
+    """
+    按段落路由的规范化，用于中英混合文档：整篇检测为'unknown'时，由
+    `detect_language(doc, segments=True)`按段落判定语言，各段以对应语言调用normalize_doc后用空格拼接，
+    而不是将整本书判为'unknown'。整篇语言明确时与normalize_doc(doc, **params)相同。
+    
+    参数：
+        doc (str)：输入文档。
+        **params：传给normalize_doc的预处理参数（lang、segment_mode会被忽略）。
+    返回：
+        同normalize_doc（各段由normalize_doc_tokens处理，也兼容只返回 `(doc, lang)` 的normalize_doc）；lang为处理后字符数最多的段落语言（全部段落都无法判定时为'unknown'），
+        若return_tokens=True，tokens为各段token列表按顺序的拼接。
+    """
+    params.pop('lang', None)
+    params.pop('segment_mode', None)
+    return_tokens = params.pop('return_tokens', False)
+    lang = detect_language(doc)
+    if lang != 'unknown':
+        result = normalize_doc_tokens(doc, lang=lang, **params)
+        return result if return_tokens else result[:2]
+
+    processed, tokens, lang_chars = [], [], {}
+    for segment, seg_lang in detect_language(doc, segments=True):
+        if seg_lang == 'unknown':
+            continue
+        seg_doc, seg_lang, seg_tokens = normalize_doc_tokens(segment, lang=seg_lang, **params)
+        if not seg_doc:
+            continue
+        processed.append(seg_doc)
+        tokens.extend(seg_tokens)
+        lang_chars[seg_lang] = lang_chars.get(seg_lang, 0) + len(seg_doc)
+    lang = max(lang_chars, key=lang_chars.get) if lang_chars else 'unknown'
+    result = (' '.join(processed), lang)
+    return result + (tokens,) if return_tokens else result
+
+# normalize_doc的步骤按固定顺序分为两段：分词前的字符级步骤（normalize_chars）和
+# 分词、词形还原之后在token上进行的步骤（normalize_tokens），normalize_docs也由这两段组成
+def normalize_chars(doc, lang,
+                    html_stripping=True,
+                    contraction_expansion=True,
+                    accented_char_removal=True,
+                    text_lower_case=True,
+                    zh_simplification=True):
+    """
+    normalize_doc分词之前的字符级步骤，按顺序：HTML标签移除；英文依次为缩写扩展、重音字符移除、
+    小写转换，中文为繁体转简体。参数同normalize_doc。
+    重音字符移除与小写转换由fold_accents（char_normalizer）合并为一次遍历（结果与依次执行remove_accented_chars、lower()相同），
+    只做小写转换时调用lower_case；两者均按名称调用，可由StageProfiler分别计时。
+    
+    示例：
+        >>> normalize_chars("<p>It's a Café</p>", 'en')
+        'it is a cafe'
+    """
+    if html_stripping:
+        doc = strip_html_tags(doc)
+    if lang == 'en':
+        if contraction_expansion:
+            doc = contractions.fix(doc)
+        if accented_char_removal:
+            doc = fold_accents(doc, lower=text_lower_case)
+        elif text_lower_case:
+            doc = lower_case(doc)
+    elif zh_simplification:
+        doc = cc_zh.convert(doc)
+    return doc
+
+def normalize_tokens(tokens, lang,
+                     special_char_removal=True,
+                     stopword_removal=True,
+                     remove_digits=False,
+                     text_lower_case=True):
+    """
+    normalize_doc在token上进行的步骤（词形还原之后），按顺序：特殊字符移除、停用词移除。
+    参数同normalize_doc；text_lower_case=True时token已是小写，停用词直接匹配。
+    
+    示例：
+        >>> normalize_tokens(['the', 'plot', 'is', 'thin', '.'], 'en')
+        ['plot', 'thin']
+    """
+    if special_char_removal:
+        tokens = remove_special_tokens(tokens, lang=lang, remove_digits=remove_digits)
+    if stopword_removal:
+        tokens = remove_stopwords_tokens(tokens, is_lower_case=text_lower_case, lang=lang)
+    return tokens
+
+# 批量规范化：大量短文本（如SST的句子）按批处理，不含标记的文档跳过HTML解析
+NORMALIZE_BATCH_SIZE = 512
+_MARKUP_CHARS = re.compile(r'[<&]')  # 不含这两个字符的文本没有HTML标签或实体，解析不会移除任何内容
+
+def normalize_docs(docs, batch_size=NORMALIZE_BATCH_SIZE, **params):
+    """
+    批量规范化大量短文本，按顺序逐个产出结果，每个结果与
+    `normalize_doc(doc, return_tokens=True, **params)`的token路径一致
+    （normalize_chars → 分词 → 词形还原 → normalize_tokens，每个文档只分词一次）。
+    
+    与逐个调用normalize_doc相比：
+        1. 不含'<'和'&'的文档（短句中几乎全部）跳过strip_html_tags：这类文本没有可移除的标签或实体，
+           每句一次的BeautifulSoup解析是短文本的主要开销；按strip_html_tags的约定，此时它只规范化换行符，
+           不影响随后的分词结果。
+        2. 英文文档整批调用一次nltk.pos_tag_sents，按文档分别标注后逐词还原
+           （与lemmatize_tokens相同：pos_tag → pos_tag_wordnet → lemmatize_word）。
+    分词器、词性标注器和停用词表已由NLTK和util.get_stopwords在进程内缓存，没有可在批内共享的准备开销；
+    分词、标注、还原的耗时仍与文档数成正比。在SST训练集（8544句）上约比逐个调用快2倍（bench_pipeline.py的短文本对比），而不是数量级的提升。
+    
+    参数：
+        docs (iterable)：文本序列，可为生成器（按batch_size分批读取）。
+        batch_size (int)：每批的文档数，默认NORMALIZE_BATCH_SIZE。
+        **params：同normalize_doc的预处理参数（lang为None时逐个文档检测语言；短文本不使用lemma_workers）。
+                  未知的参数（如拼写错误）立即引发TypeError。
+    
+    返回：
+        生成器：按输入顺序产出 `(doc, lang)`，return_tokens=True时为 `(doc, lang, tokens)`；
+        语言为'unknown'的文档原样返回。
+    
+    示例（需先实现normalize_doc用到的各步骤函数，如strip_html_tags、remove_accented_chars）：
+        >>> for doc, lang in normalize_docs(sentences, batch_size=256):
+        ...     print(doc, lang)
+    """
+    inspect.signature(_normalize_batch).bind(None, **params)
+    return _iter_normalized_batches(docs, batch_size, params)
+
+def _iter_normalized_batches(docs, batch_size, params):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield from _normalize_batch(batch, **params)
+            batch = []
+    if batch:
+        yield from _normalize_batch(batch, **params)
+
+def _normalize_batch(docs,
+                     html_stripping=True,
+                     contraction_expansion=True,
+                     accented_char_removal=True,
+                     text_lower_case=True,
+                     text_lemmatization=True,
+                     special_char_removal=True,
+                     stopword_removal=True,
+                     remove_digits=False,
+                     zh_simplification=True,
+                     isDebug=False,
+                     lang=None,
+                     lemma_workers=1,
+                     zh_workers=1,
+                     return_tokens=False):
+    """normalize_docs的一批：逐文档执行字符级步骤（无标记时跳过HTML解析）并分词，英文文档整批标注词性后，逐文档执行token步骤"""
+    langs = [lang or detect_language(doc) for doc in docs]
+    index = [i for i, doc_lang in enumerate(langs) if doc_lang != 'unknown']
+    token_lists = {}
+    for i in index:
+        text = normalize_chars(docs[i], langs[i],
+                               html_stripping=html_stripping and _MARKUP_CHARS.search(docs[i]) is not None,
+                               contraction_expansion=contraction_expansion,
+                               accented_char_removal=accented_char_removal,
+                               text_lower_case=text_lower_case,
+                               zh_simplification=zh_simplification)
+        token_lists[i] = tokenize_text(text, langs[i], workers=zh_workers)
+
+    en_index = [i for i in index if langs[i] == 'en']
+    if text_lemmatization and en_index:
+        tagged_lists = nltk.pos_tag_sents([token_lists[i] for i in en_index])
+        for i, tagged in zip(en_index, tagged_lists):
+            token_lists[i] = [lemmatize_word(word, pos) for word, pos in pos_tag_wordnet(tagged)]
+
+    results = []
+    for i, (doc, doc_lang) in enumerate(zip(docs, langs)):
+        if i in token_lists:
+            tokens = normalize_tokens(token_lists[i], doc_lang,
+                                      special_char_removal=special_char_removal,
+                                      stopword_removal=stopword_removal,
+                                      remove_digits=remove_digits,
+                                      text_lower_case=text_lower_case)
+            result = (' '.join(tokens), doc_lang, tokens)
+        else:
+            result = (doc, doc_lang, [])
+        results.append(result if return_tokens else result[:2])
+    if isDebug and text_lemmatization:
+        print(lemma_cache_info())
+    return results
+
+# 分阶段性能分析：normalize_doc按名称调用各步骤函数，分析期间将这些名称临时替换为计时包装
+PROFILED_STAGES = [
+    ('language_detection', 'detect_language'),
+    ('html_stripping', 'strip_html_tags'),
+    ('contraction_expansion', 'contractions.fix'),
+    ('accented_char_removal', 'remove_accented_chars'),
+    ('accented_char_removal', 'fold_accents'),
+    ('text_lower_case', 'lower_case'),
+    ('zh_simplification', 'cc_zh.convert'),
+    ('tokenization', 'tokenize_text'),
+    ('text_lemmatization', 'lemmatize_text'),
+    ('text_lemmatization', 'lemmatize_tokens'),
+    ('text_lemmatization', 'lemmatize_tokens_in_context'),
+    ('special_char_removal', 'remove_special_characters'),
+    ('special_char_removal', 'remove_special_tokens'),
+    ('stopword_removal', 'remove_stopwords'),
+    ('stopword_removal', 'remove_stopwords_tokens'),
+]
+
+class StageProfiler:
+    """
+    normalize_doc的分阶段性能分析。在with块内，PROFILED_STAGES中的步骤函数被替换为计时包装，
+    对每个被调用的步骤记录：调用次数、墙钟时间、CPU时间、输入/输出字符数、token数（仅对输入/输出为token列表的步骤，
+    否则为None）、峰值内存增量；
+    退出时恢复原函数。步骤内部再调用其他步骤（如lemmatize_tokens_in_context在分片校验失败时
+    调用自身）只计入外层步骤。
+    
+    参数：
+        memory (bool)：是否用tracemalloc记录峰值内存增量，默认True（会使被测代码明显变慢，
+                       时间应与不记录内存时的运行对比；子进程中的内存不计入）。
+    
+    示例：
+        >>> with StageProfiler() as profiler:
+        ...     doc, lang = normalize_doc(text)
+        >>> print(profiler.to_markdown())
+    """
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.stats = {}
+        self.total = None
+        self._patched = []
+        self._active = False
+
+    def __enter__(self):
+        module = globals()
+        for stage, name in PROFILED_STAGES:
+            owner_name, _, attr = name.rpartition('.')
+            owner = module[owner_name] if owner_name else None
+            if owner is None:
+                original = module[attr]
+                module[attr] = self._wrap(stage, original)
+            elif isinstance(owner, LazyResource):  # 不为分析而提前创建对象（如OpenCC）
+                original = (lambda owner, attr: lambda *a, **kw: getattr(owner.get(), attr)(*a, **kw))(owner, attr)
+                setattr(owner, attr, self._wrap(stage, original))
+            else:
+                original = getattr(owner, attr)
+                setattr(owner, attr, self._wrap(stage, original))
+            self._patched.append((owner, attr, original))
+        self._tracing = self.memory and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        self._start = (time.perf_counter(), time.process_time())
+        return self
+
+    def __exit__(self, *exc):
+        wall, cpu = time.perf_counter() - self._start[0], time.process_time() - self._start[1]
+        self.total = {'wall': wall, 'cpu': cpu}
+        if self._tracing:
+            tracemalloc.stop()
+        module = globals()
+        for owner, attr, original in reversed(self._patched):
+            if owner is None:
+                module[attr] = original
+            elif isinstance(owner, LazyResource):
+                delattr(owner, attr)
+            else:
+                setattr(owner, attr, original)
+        self._patched = []
+        return False
+
+    def _wrap(self, stage, func):
+        def wrapper(*args, **kwargs):
+            if self._active:  # 嵌套调用只计入外层步骤
+                return func(*args, **kwargs)
+            self._active = True
+            if self.memory:
+                tracemalloc.reset_peak()
+                mem_start = tracemalloc.get_traced_memory()[0]
+            wall, cpu = time.perf_counter(), time.process_time()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                peak = tracemalloc.get_traced_memory()[1] - mem_start if self.memory else 0
+                self._active = False
+            self._record(stage, wall, cpu, peak, args[0] if args else None, result)
+            return result
+        return wrapper
+
+    def _record(self, stage, wall, cpu, peak, data_in, data_out):
+        entry = self.stats.setdefault(stage, {
+            'stage': stage, 'calls': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'chars_in': 0, 'chars_out': 0,
+            'tokens_in': None, 'tokens_out': None, 'peak_mem_delta_bytes': 0})
+        entry['calls'] += 1
+        entry['wall_s'] += wall
+        entry['cpu_s'] += cpu
+        entry['peak_mem_delta_bytes'] = max(entry['peak_mem_delta_bytes'], peak)
+        if stage == 'language_detection':
+            data_out = data_in  # 只判定语言，不改变文本
+        # token数只对token列表统计：按空白切分文本不是token数（中文文本几乎没有空白）
+        for key, data in (('in', data_in), ('out', data_out)):
+            if isinstance(data, str):
+                entry[f'chars_{key}'] += len(data)
+            elif isinstance(data, list):
+                entry[f'chars_{key}'] += sum(len(token) for token in data)
+                entry[f'tokens_{key}'] = (entry[f'tokens_{key}'] or 0) + len(data)
+
+    def records(self):
+        """按步骤顺序返回各步骤的统计（字典列表），末尾为'other'（未归入任何步骤的时间，如各步骤之间的拼接与参数处理）和'total'"""
+        order = {stage: i for i, (stage, _) in enumerate(PROFILED_STAGES)}
+        records = sorted(self.stats.values(), key=lambda entry: order[entry['stage']])
+        if self.total:
+            records.append({'stage': 'other', 'calls': None,
+                            'wall_s': max(0.0, self.total['wall'] - sum(r['wall_s'] for r in records)),
+                            'cpu_s': max(0.0, self.total['cpu'] - sum(r['cpu_s'] for r in records))})
+            records.append({'stage': 'total', 'calls': None, 'wall_s': self.total['wall'], 'cpu_s': self.total['cpu']})
+        return records
+
+    def to_markdown(self):
+        """以Markdown表格返回各步骤的统计"""
+        lines = ["| 步骤 | 调用次数 | 墙钟时间(s) | CPU时间(s) | 输入字符 | 输出字符 | 输入token | 输出token | 峰值内存增量(MB) |",
+                 "|------|----------|-------------|------------|----------|----------|-----------|-----------|------------------|"]
+        for r in self.records():
+            cells = [r['stage'], r['calls'], f"{r['wall_s']:.3f}", f"{r['cpu_s']:.3f}",
+                     r.get('chars_in'), r.get('chars_out'), r.get('tokens_in'), r.get('tokens_out'),
+                     f"{r['peak_mem_delta_bytes'] / (1 << 20):.1f}" if self.memory and 'peak_mem_delta_bytes' in r else None]
+            lines.append("| " + " | ".join('-' if cell is None else str(cell) for cell in cells) + " |")
+        return "\n".join(lines)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+"""
+预处理流水线基准测试：对data/下的书籍及其按倍数放大的合成版本，测量
+  1. fetch_gutenberg_text（读取与正文提取）；
+  2. normalize_doc中的各预处理步骤（由Assign1_func.StageProfiler分阶段计时）及normalize_doc整体；
+  3. get_statistics（分词与词频统计）；
+的吞吐量（字符/秒、token/秒）与峰值内存增量，按书籍和语言汇总输出Markdown表格。
+另对大量短文本（默认Assign3的SST训练集）比较逐个调用normalize_doc与批量的normalize_docs，并输出加速比。
+
+结果可保存为基线（--save_baseline），之后的运行与基线比较（--baseline），
+吞吐量下降超过阈值（--threshold，默认20%）的项被标记为退化，并以非零状态退出。
+
+用法：
+    python bench_pipeline.py --save_baseline bench_baseline.json
+    python bench_pipeline.py --baseline bench_baseline.json --threshold 0.2
+"""
+
+import argparse
+import io
+import json
+import platform
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import Assign1_func
+from Assign1_func import StageProfiler, ensure_nltk_data, normalize_docs
+from util import GUTENBERG_START_PAT, GUTENBERG_END_PAT, fetch_gutenberg_text, get_statistics, tokenize_text
+
+HERE = Path(__file__).resolve().parent
+DEFAULT_BOOKS = ['1342-0', '8001', '23950-0', '24264-0', '7337-0']
+DEFAULT_SHORT_DOCS = HERE.parent / 'Assign3' / 'data' / 'sst-train.txt'
+# 首尾标记均为ASCII字符，在原始字节上定位，合成文件与原书的编码相同
+_START_BYTES = re.compile(GUTENBERG_START_PAT.pattern.encode('ascii'), GUTENBERG_START_PAT.flags & ~re.UNICODE)
+_END_BYTES = re.compile(GUTENBERG_END_PAT.pattern.encode('ascii'), GUTENBERG_END_PAT.flags & ~re.UNICODE)
+
+def make_scaled_copy(src, scale, out_dir):
+    """
+    生成正文重复scale次的合成古腾堡文件（保留首尾标记），返回其路径；
+    按字节复制，不解码再编码，latin-1等编码的书籍由fetch_gutenberg_text读到的文本与原书相同
+    """
+    if scale == 1:
+        return str(src)
+    raw = Path(src).read_bytes()
+    start, end = _START_BYTES.search(raw), _END_BYTES.search(raw)
+    if not start or not end or start.end() > end.start():
+        body, head, tail = raw, b'', b''
+    else:
+        head, body, tail = raw[:start.end()], raw[start.end():end.start()], raw[end.start():]
+    path = Path(out_dir) / f"{Path(src).stem}-x{scale}.txt"
+    path.write_bytes(head + body * scale + tail)
+    return str(path)
+
+def measure(func, repeat, memory):
+    """运行func共repeat次，返回 (结果, 最短墙钟时间, 峰值内存增量字节数)；内存在额外一次运行中测量"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, best, peak
+
+def stage_stats(wall, chars, tokens, peak):
+    """一个阶段的统计：时间、字符/token数及吞吐量、峰值内存增量（MB）"""
+    return {
+        'wall_s': wall, 'chars': chars, 'tokens': tokens,
+        'chars_per_s': chars / wall if wall else None,
+        'tokens_per_s': tokens / wall if wall and tokens is not None else None,
+        'peak_mem_mb': peak / (1 << 20) if peak is not None else None,
+    }
+
+def bench_book(path, repeat, memory):
+    """对一本书测量各阶段，返回 (语言, {阶段: 统计})；无法读取或未实现normalize_doc时返回 (None, {})"""
+    results = {}
+    def add(stage, *stats):
+        results[stage] = stage_stats(*stats)
+
+    def fetch():
+        with redirect_stdout(io.StringIO()):  # 不输出读取过程信息
+            return fetch_gutenberg_text(path)
+    doc, wall, peak = measure(fetch, repeat, memory)
+    if not doc:
+        return None, {}
+    add('fetch_gutenberg_text', wall, len(doc), None, peak)
+
+    # normalize_doc整体及其中各步骤：计时运行不开tracemalloc，内存在单独一次运行中测量
+    timing = []
+    for _ in range(repeat):
+        with StageProfiler(memory=False) as profiler:
+            output = Assign1_func.normalize_doc(doc)
+        timing.append(profiler)
+    if not output:
+        print(f"警告：normalize_doc未实现，跳过 {path} 的预处理步骤")
+        return None, results
+    processed, lang = output[0], output[1]
+    best = min(timing, key=lambda p: p.total['wall'])
+    peaks = {}
+    if memory:
+        with StageProfiler(memory=True) as mem_profiler:
+            Assign1_func.normalize_doc(doc)
+        peaks = {r['stage']: r.get('peak_mem_delta_bytes') for r in mem_profiler.records()}
+    for r in best.records():
+        if r['stage'] in ('other', 'total'):
+            continue
+        add(r['stage'], r['wall_s'], r['chars_in'], r['tokens_in'], peaks.get(r['stage']))
+    # token数按语言分词计数（每本书一次，不计入时间）；中文文本按空白切分得到的不是token数
+    tokens_in = len(tokenize_text(doc, lang)) if lang in ('en', 'zh') else None
+    add('normalize_doc', best.total['wall'], len(doc), tokens_in, None)
+
+    if lang in ('en', 'zh') and processed:
+        stats_tokens = len(tokenize_text(processed, lang))
+        _, wall, peak = measure(lambda: get_statistics(processed, n=10, k=20, lang=lang), repeat, memory)
+        add('get_statistics', wall, len(processed), stats_tokens, peak)
+    return lang, results
+
+def read_short_docs(path):
+    """读取短文本，每行一个文档；SST格式（标签 ||| 句子）只取句子"""
+    with open(path, 'r', encoding='utf-8') as f:
+        docs = (line.split(' ||| ', 1)[-1].strip() for line in f)
+        return [doc for doc in docs if doc]
+
+def bench_short_docs(docs, repeat, memory):
+    """
+    对大量短文本比较逐个调用normalize_doc与normalize_docs（均为默认预处理参数），
+    返回 {阶段: 统计}；未实现normalize_doc时返回{}
+    """
+    if not Assign1_func.normalize_doc(docs[0]):
+        print("警告：normalize_doc未实现，跳过短文本的批量处理对比")
+        return {}
+    per_doc, wall_doc, peak_doc = measure(lambda: [Assign1_func.normalize_doc(doc) for doc in docs], repeat, memory)
+    batched, wall_batch, peak_batch = measure(lambda: list(normalize_docs(docs)), repeat, memory)
+    mismatched = sum(a[:2] != b for a, b in zip(per_doc, batched))
+    if mismatched:
+        print(f"警告：{mismatched}/{len(docs)}个文档的normalize_docs结果与normalize_doc不同")
+    # token数按各文档的语言分词计数（不计入时间）
+    tokens = sum(len(tokenize_text(doc, lang)) for doc, (_, lang) in zip(docs, batched) if lang in ('en', 'zh'))
+    chars = sum(len(doc) for doc in docs)
+    return {
+        'normalize_doc（逐个）': stage_stats(wall_doc, chars, tokens, peak_doc),
+        'normalize_docs': stage_stats(wall_batch, chars, tokens, peak_batch),
+    }
+
+def summarize_by_language(books):
+    """按语言汇总：各阶段总字符数/总token数除以总时间"""
+    totals = {}
+    for book in books.values():
+        for stage, r in book['stages'].items():
+            t = totals.setdefault(book['lang'], {}).setdefault(stage, {'wall_s': 0.0, 'chars': 0, 'tokens': 0, 'peak_mem_mb': None})
+            t['wall_s'] += r['wall_s']
+            t['chars'] += r['chars']
+            t['tokens'] = None if r['tokens'] is None or t['tokens'] is None else t['tokens'] + r['tokens']
+            if r['peak_mem_mb'] is not None:
+                t['peak_mem_mb'] = max(t['peak_mem_mb'] or 0.0, r['peak_mem_mb'])
+    for stages in totals.values():
+        for t in stages.values():
+            t['chars_per_s'] = t['chars'] / t['wall_s'] if t['wall_s'] else None
+            t['tokens_per_s'] = t['tokens'] / t['wall_s'] if t['wall_s'] and t['tokens'] is not None else None
+    return totals
+
+def fmt(value, spec):
+    return '-' if value is None else format(value, spec)
+
+def print_table(title, stages):
+    print(f"\n## {title}")
+    print("| 阶段 | 时间(s) | 字符/秒 | token/秒 | 峰值内存增量(MB) |")
+    print("|------|---------|---------|----------|------------------|")
+    for stage, r in stages.items():
+        print(f"| {stage} | {fmt(r['wall_s'], '.3f')} | {fmt(r['chars_per_s'], ',.0f')} | "
+              f"{fmt(r['tokens_per_s'], ',.0f')} | {fmt(r['peak_mem_mb'], '.1f')} |")
+
+def compare_with_baseline(current, baseline, threshold):
+    """逐项比较字符/秒吞吐量，返回下降超过阈值的项 [(名称, 阶段, 基线, 当前, 变化比例)]"""
+    regressions = []
+    for section in ('books', 'languages', 'short_docs'):
+        for name, entry in current.get(section, {}).items():
+            base_entry = baseline.get(section, {}).get(name)
+            if not base_entry:
+                continue
+            stages = entry['stages'] if section != 'languages' else entry
+            base_stages = base_entry['stages'] if section != 'languages' else base_entry
+            for stage, r in stages.items():
+                base = base_stages.get(stage, {}).get('chars_per_s')
+                if base and r['chars_per_s'] is not None and r['chars_per_s'] < base * (1 - threshold):
+                    regressions.append((name, stage, base, r['chars_per_s'], r['chars_per_s'] / base - 1))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Assign1预处理流水线基准测试")
+    parser.add_argument('--data_dir', default=str(HERE / 'data'), help="书籍目录")
+    parser.add_argument('--books', nargs='+', default=DEFAULT_BOOKS, help="书籍文件名（不含.txt）")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 4], help="合成版本的正文放大倍数（1为原书）")
+    parser.add_argument('--repeat', type=int, default=3, help="计时重复次数（取最短时间）")
+    parser.add_argument('--no_memory', action='store_true', help="不测量峰值内存（省去额外的tracemalloc运行）")
+    parser.add_argument('--short_docs', default=str(DEFAULT_SHORT_DOCS),
+                        help="短文本文件（每行一个文档，SST格式只取句子），用于比较normalize_doc与normalize_docs；空字符串表示跳过")
+    parser.add_argument('--save_baseline', default=None, help="将本次结果保存为基线JSON")
+    parser.add_argument('--baseline', default=None, help="与该基线JSON比较")
+    parser.add_argument('--threshold', type=float, default=0.2, help="吞吐量下降超过该比例即视为退化（默认0.2）")
+    args = parser.parse_args()
+
+    ensure_nltk_data()
+    books = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for book in args.books:
+            src = Path(args.data_dir) / f"{book}.txt"
+            if not src.exists():
+                print(f"警告：找不到 {src}，跳过")
+                continue
+            for scale in args.scales:
+                name = f"{book}x{scale}"
+                lang, stages = bench_book(make_scaled_copy(src, scale, tmp), args.repeat, not args.no_memory)
+                if stages:
+                    books[name] = {'lang': lang or 'unknown', 'scale': scale, 'stages': stages}
+
+    short_docs = {}
+    if args.short_docs:
+        if Path(args.short_docs).exists():
+            docs = read_short_docs(args.short_docs)
+            stages = bench_short_docs(docs, args.repeat, not args.no_memory) if docs else {}
+            if stages:
+                short_docs[Path(args.short_docs).stem] = {'docs': len(docs), 'stages': stages}
+        else:
+            print(f"警告：找不到 {args.short_docs}，跳过短文本的批量处理对比")
+
+    print("# 预处理流水线基准测试")
+    for name, book in books.items():
+        print_table(f"{name}（{book['lang']}）", book['stages'])
+    languages = summarize_by_language(books)
+    for lang, stages in languages.items():
+        print_table(f"语言汇总：{lang}", stages)
+    for name, entry in short_docs.items():
+        print_table(f"短文本：{name}（{entry['docs']}个文档）", entry['stages'])
+        per_doc, batched = entry['stages'].values()
+        print(f"\nnormalize_docs相对逐个调用normalize_doc：{per_doc['wall_s'] / batched['wall_s']:.1f}倍")
+
+    current = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {'python': platform.python_version(), 'platform': platform.platform()},
+        'settings': {'books': args.books, 'scales': args.scales, 'repeat': args.repeat, 'short_docs': args.short_docs},
+        'books': books,
+        'languages': languages,
+        'short_docs': short_docs,
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"\n✅ 基线已保存至：{args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(current, baseline, args.threshold)
+        if regressions:
+            print(f"\n## ❌ 吞吐量退化（超过{args.threshold:.0%}）")
+            print("| 书籍/语言 | 阶段 | 基线字符/秒 | 当前字符/秒 | 变化 |")
+            print("|-----------|------|-------------|-------------|------|")
+            for name, stage, base, now, change in regressions:
+                print(f"| {name} | {stage} | {base:,.0f} | {now:,.0f} | {change:+.0%} |")
+            sys.exit(1)
+        print(f"\n✅ 与基线相比无超过{args.threshold:.0%}的吞吐量退化")
+
+if __name__ == '__main__':
+    main()
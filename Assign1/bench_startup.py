@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+"""
+启动时间基准：在新的子进程中分别测量
+  1. import Assign1_func / import util 的耗时；
+  2. 空书单的Assign1.py完整运行（解析参数、读取配置、输出报告头）的耗时。
+每项重复多次取中位数；超过阈值时以非零状态退出，便于发现重新引入的导入期开销。
+
+用法：python bench_startup.py [--repeat 5] [--limit 1.0]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+def time_command(cmd, repeat, env):
+    """重复运行命令，返回各次耗时（秒）的中位数"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=HERE, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description="测量Assign1的导入和空运行启动时间")
+    parser.add_argument('--repeat', type=int, default=5, help="每项重复次数（取中位数）")
+    parser.add_argument('--limit', type=float, default=1.0, help="空运行耗时上限（秒）")
+    args = parser.parse_args()
+
+    env = dict(os.environ, NLTK_OFFLINE='1')  # 不访问网络
+    with tempfile.TemporaryDirectory() as tmp:
+        empty_config = Path(tmp) / 'empty.json'
+        empty_config.write_text(json.dumps({'booklist': [], 'preprocessing_params': []}), encoding='utf-8')
+        cases = [
+            ("python -c pass", [sys.executable, '-c', 'pass']),
+            ("import util", [sys.executable, '-c', 'import util']),
+            ("import Assign1_func", [sys.executable, '-c', 'import Assign1_func']),
+            ("Assign1.py 空书单", [sys.executable, 'Assign1.py', str(empty_config), '--offline']),
+        ]
+        print("| 项目 | 中位耗时 (ms) |")
+        print("|------|---------------|")
+        results = {}
+        for name, cmd in cases:
+            results[name] = time_command(cmd, args.repeat, env)
+            print(f"| {name} | {results[name] * 1000:.0f} |")
+
+    noop = results["Assign1.py 空书单"]
+    if noop > args.limit:
+        print(f"\n❌ 空运行耗时 {noop:.2f}s 超过上限 {args.limit:.2f}s")
+        sys.exit(1)
+    print(f"\n✅ 空运行耗时 {noop:.2f}s（上限 {args.limit:.2f}s）")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/env python3
+
+"""
+缩写检查的回归测试：对提供的处理后示例文本（默认data/8001-p.txt），比较
+  1. util.test_english_contractions（单次扫描）；
+  2. 对contractions_dict中每个缩写分别搜索\\b缩写\\b（完整单词匹配）；
+的结果，并检查正确处理的示例文本不报告任何未扩展的缩写。结果不一致时以非零状态退出。
+
+用法：python check_contractions.py [data/8001-p.txt ...]
+"""
+
+import re
+import sys
+from pathlib import Path
+
+import contractions
+from util import test_english_contractions
+
+HERE = Path(__file__).resolve().parent
+DEFAULT_FILES = [HERE / 'data' / '8001-p.txt']
+
+def reference_errors(processed):
+    """逐个缩写搜索\\b缩写\\b的参考实现"""
+    processed_lower = processed.lower()
+    return [f"处理后的文本仍包含未扩展的缩写: '{contraction}'"
+            for contraction in contractions.contractions_dict.keys()
+            if re.search(rf'\b{re.escape(contraction)}\b', processed_lower)]
+
+def main():
+    files = [Path(p) for p in sys.argv[1:]] or DEFAULT_FILES
+    failed = False
+    for path in files:
+        processed = path.read_text(encoding='utf-8')
+        errors, expected = test_english_contractions(processed), reference_errors(processed)
+        if errors != expected:
+            print(f"❌ {path}: 单次扫描结果 {errors} 与逐个搜索结果 {expected} 不一致")
+            failed = True
+        elif errors:
+            print(f"❌ {path}: 示例文本不应包含未扩展的缩写，实际报告 {errors}")
+            failed = True
+        else:
+            print(f"✅ {path}: 未发现未扩展的缩写")
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
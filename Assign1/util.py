@@ -4,12 +4,76 @@
 # @Last Modified by:   Haiqin Yang
 # @Last Modified time: 2025-10-18 19:32:15
 import nltk
-import jieba
 import contractions
 import re
+import asyncio
+import atexit
+import codecs
+import collections
+import hashlib
+import heapq
+import importlib
+import itertools
+import json
+import mmap
+import os
+import shutil
+import time
+from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path  # 确保已导入
 
-def detect_language(text):
+class LazyResource:
+    """
+    首次使用时才创建的对象代理：访问属性或调用时才执行factory()，之后复用同一对象。
+    用于jieba、BeautifulSoup、OpenCC等导入或初始化较慢、且只在某种语言下才用到的工具。
+    
+    示例：
+        >>> jieba = LazyResource(lambda: importlib.import_module('jieba'))
+        >>> jieba.lcut('中文分词')  # 此时才导入jieba
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._obj = None
+
+    def get(self):
+        if self._obj is None:
+            self._obj = self._factory()
+        return self._obj
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+def lazy_import(name, attr=None):
+    """返回模块name（或其属性attr）的LazyResource代理，首次使用时才导入"""
+    if attr is None:
+        return LazyResource(lambda: importlib.import_module(name))
+    return LazyResource(lambda: getattr(importlib.import_module(name), attr))
+
+jieba = lazy_import('jieba')  # 中文分词（仅处理中文时才导入）
+requests = lazy_import('requests')  # 仅下载古腾堡URL时才导入
+np = lazy_import('numpy')  # 仅读写token id数组时才导入
+
+# 古腾堡标准标记（整篇读取与流式读取共用）
+# 匹配 "*** START OF THE PROJECT GUTENBERG EBOOK ... ***" 及变体
+GUTENBERG_START_PAT = re.compile(
+    r'\*{3}\s+START OF (?:THE|THIS)?\s+PROJECT GUTENBERG EBOOK.*?\*{3}',
+    re.IGNORECASE | re.DOTALL
+)
+# 匹配 "*** END OF THE PROJECT GUTENBERG EBOOK ... ***" 及变体
+GUTENBERG_END_PAT = re.compile(
+    r'\*{3}\s+END OF (?:THE|THIS)?\s+PROJECT GUTENBERG EBOOK.*?\*{3}',
+    re.IGNORECASE | re.DOTALL
+)
+# 字节版本：标记均为ASCII字符，可直接在文件的字节内容（mmap）上定位，无需先解码全文
+_GUTENBERG_START_BYTES = re.compile(GUTENBERG_START_PAT.pattern.encode('ascii'), re.IGNORECASE | re.DOTALL)
+_GUTENBERG_END_BYTES = re.compile(GUTENBERG_END_PAT.pattern.encode('ascii'), re.IGNORECASE | re.DOTALL)
+
+def detect_language(text, sample_chars=None, segments=False):
     '''
     更严谨的实现是使用langdetect包，但该包有时会误判中英混合文本为其他语言
     需要安装：pip install langdetect
@@ -24,20 +88,73 @@ def detect_language(text):
             return 'zh' if lang == 'zh-cn' else 'en' if lang == 'en' else 'unknown'
         except LangDetectException:
             return 'unknown'
+
+    这里按CJK字符与英文字母的占比判定，只计数、不为每个字符生成列表；逐块扫描，
+    一旦剩余文本无论内容如何都不会改变结论即提前结束（结果与扫描全文相同）。
+    
+    参数：
+        text: 输入文本
+        sample_chars: 采样字符数上限（可选）。文本更长时只在均匀分布的若干窗口中取样判定，
+                      耗时与文本长度无关；为None时扫描全文（可提前结束）。
+        segments: 是否按段落（空行分隔）分别判定语言。为True时返回列表 [(段落文本, 语言), ...]：
+                  相邻同语言的段落合并为一段，无法判定的段落（如纯数字、标点）并入前一段（开头的并入后一段），
+                  各段依次拼接即为原文。可用于中英混合文档按段落选择分词器。
+    
+    返回：
+        'zh'/'en'/'unknown'；segments=True时为上述列表。
+    
+    示例：
+        >>> detect_language('Chapter 1. It was a dark night.\n\n第一回 甄士隐梦幻识通灵', segments=True)
+        [('Chapter 1. It was a dark night.\n\n', 'en'), ('第一回 甄士隐梦幻识通灵', 'zh')]
     '''
-    if not text.strip():
+    if segments:
+        return _detect_language_segments(text)
+    text = text.strip()
+    if not text:
         return 'unknown'
     
-    # 提取中文CJK字符和英文单词字符
-    cjk_chars = re.findall(r'[\u4e00-\u9fff]', text)
-    en_chars = re.findall(r'[a-zA-Z]', text)  # 英文特征：字母
+    total, windows = len(text), [text]
+    if sample_chars and total > sample_chars:
+        # 在全文均匀分布的窗口中取样，样本即视为全文
+        size = max(1, sample_chars // LANG_SAMPLE_WINDOWS)
+        step = (total - size) / (LANG_SAMPLE_WINDOWS - 1)
+        windows = [text[int(i * step):int(i * step) + size] for i in range(LANG_SAMPLE_WINDOWS)]
+        total = size * LANG_SAMPLE_WINDOWS
     
-    total = len(text.strip())
+    # 逐块计数CJK字符和英文字母，结论确定后提前结束
+    n_cjk = n_en = scanned = 0
+    for window in windows:
+        for start in range(0, len(window), LANG_BLOCK_CHARS):
+            block = window[start:start + LANG_BLOCK_CHARS]
+            c, e = _count_lang_chars(block)
+            n_cjk, n_en, scanned = n_cjk + c, n_en + e, scanned + len(block)
+            lang = _settled_language(n_cjk, n_en, total - scanned, total)
+            if lang:
+                return lang
+    return _decide_language(n_cjk, n_en, total)
+
+def detect_language_chunks(chunks):
+    '''
+    流式版本的detect_language：逐块累计CJK字符与英文字母数量，不拼接全文
+    
+    参数：
+        chunks: 可迭代的文本块，拼接后等于整篇文本（如iter_gutenberg_text的输出）
+    返回：
+        元组 (lang, total)，lang与detect_language(''.join(chunks))一致，total为文本总字符数
+    '''
+    n_cjk = n_en = total = 0
+    for chunk in chunks:
+        c, e = _count_lang_chars(chunk)
+        n_cjk, n_en, total = n_cjk + c, n_en + e, total + len(chunk)
+    return _decide_language(n_cjk, n_en, total), total
+
+def _decide_language(n_cjk, n_en, total):
+    '''根据CJK字符数、英文字母数和文本总长度判定语言'''
     if total == 0:
         return 'unknown'
     
-    cjk_ratio = len(cjk_chars) / total
-    en_ratio = len(en_chars) / total
+    cjk_ratio = n_cjk / total
+    en_ratio = n_en / total
     
     # 中文判定：CJK占比超30%
     if cjk_ratio > 0.3:
@@ -49,52 +166,369 @@ def detect_language(text):
     else:
         return 'unknown'
 
-def get_statistics(text, n=10, k=10, lang='en'):
+LANG_BLOCK_CHARS = 1 << 16  # detect_language逐块扫描的块大小
+LANG_SAMPLE_WINDOWS = 8  # 采样判定时的窗口数
+_NON_CJK_RUNS = re.compile(r'[^\u4e00-\u9fff]+')
+_ASCII_LETTERS = bytes(range(ord('A'), ord('Z') + 1)) + bytes(range(ord('a'), ord('z') + 1))
+_PARAGRAPH_SEP = re.compile(r'(\n\s*\n)')
+
+def _count_lang_chars(text):
+    '''
+    统计CJK字符（\u4e00-\u9fff）和英文字母（a-zA-Z）的个数，不为每个字符生成列表：
+    CJK字符数为删去所有非CJK片段后的长度；英文字母在utf-8中均为单字节，
+    其个数为编码后删去这些字节前后的长度差。
+    '''
+    n_cjk = len(_NON_CJK_RUNS.sub('', text))
+    data = text.encode('utf-8', 'surrogatepass')
+    return n_cjk, len(data) - len(data.translate(None, _ASCII_LETTERS))
+
+def _settled_language(n_cjk, n_en, remaining, total):
+    '''
+    已扫描部分计数为(n_cjk, n_en)、还剩remaining个字符未扫描时，若无论剩余内容如何
+    _decide_language的结论都相同，返回该结论，否则返回None
+    '''
+    if n_cjk > 0.3 * total:
+        return 'zh'
+    if n_cjk + remaining <= 0.3 * total:  # 不可能判为中文
+        if n_en > 0.3 * total and n_cjk + remaining < 0.1 * total:
+            return 'en'
+        if n_en + remaining <= 0.3 * total or n_cjk >= 0.1 * total:
+            return 'unknown'
+    return None
+
+def _detect_language_segments(text):
+    '''detect_language(text, segments=True)的实现：按空行切分段落，逐段判定后合并'''
+    parts = _PARAGRAPH_SEP.split(text)
+    # 段落与其后的空行分隔符合为一段，保证各段拼接即为原文
+    paragraphs = [parts[i] + (parts[i + 1] if i + 1 < len(parts) else '') for i in range(0, len(parts), 2)]
+    result, pending = [], ''
+    for paragraph in paragraphs:
+        lang = detect_language(paragraph)
+        if lang == 'unknown' and result:
+            result[-1][0] += paragraph  # 无法判定的段落并入前一段
+        elif lang == 'unknown':
+            pending += paragraph  # 开头无法判定的段落并入后一段
+        elif result and result[-1][1] == lang:
+            result[-1][0] += paragraph
+        else:
+            result.append([pending + paragraph, lang])
+            pending = ''
+    if pending:
+        result.append([pending, 'unknown'])  # 全文均无法判定
+    return [(segment, lang) for segment, lang in result]
+
+def get_statistics(text, n=10, k=10, lang='en', workers=1):
     '''
     获取文本中前n个高频词和长度最长的k个词
     
     参数：
-        text: 输入文本
+        text: 输入文本；也可以是已切好的token列表（如normalize_doc(..., return_tokens=True)返回的tokens），
+              此时直接统计，不再重复分词
         n: 高频词数量（默认10）
         k: 最长词数量（默认10）
         lang: 语言（'en'英文/'zh'中文，默认'en'）
+        workers: 中文分词的进程数（默认1，见segment_zh）
     
     返回：
         元组 (top_n_words, longest_k_words)，其中：
             - top_n_words: 列表，元素为 (词, 频率) 元组，按频率降序排列
             - longest_k_words: 列表，元素为 (词, 长度) 元组，按长度降序排列（长度相同则按词本身排序）
     '''    
-    if not text.strip():
+    if not isinstance(text, str):
+        tokens = [token for token in text if token]  # 已分词的输入
+    elif not text.strip():
         return ([], [])  # 空文本返回两个空列表
+    else:
+        # 1. 分词（中英文适配）
+        tokens = tokenize_text(text, lang, workers=workers)
+    
+    # 2. 统计词频并取前n个高频词和最长的k个词
+    return TokenStatistics(tokens).summarize(n=n, k=k)
+
+def tokenize_text(text, lang='en', workers=1):
+    '''
+    按语言分词并过滤空token（get_statistics与流式统计共用）
     
-    # 1. 分词（中英文适配）
+    参数：
+        text: 输入文本
+        lang: 语言（'en'英文/'zh'中文，默认'en'）
+        workers: 中文分词的进程数（默认1，见segment_zh）
+    返回：
+        列表：非空token
+    '''
     if lang == 'en':
         tokens = nltk.word_tokenize(text)
     elif lang == 'zh':
-        tokens = jieba.lcut(text)  # 中文精确分词
+        tokens = segment_zh(text, workers=workers)  # 中文精确分词
     else:
         raise ValueError("Unsupported language. Use 'en' or 'zh'.")
     
     # 过滤空字符串（移除纯空格/空的token）
     tokens = [token.strip() for token in tokens]
-    tokens = [token for token in tokens if token]  # 保留非空token
+    return [token for token in tokens if token]  # 保留非空token
+
+# 中文分词：jieba词典缓存与多进程分批分词
+ZH_SENTENCE_END = re.compile(r'[。！？!?；;…]+[”’」』）)》]*')  # 句末标点（含其后的右引号/括号）
+ZH_BATCH_CHARS = 20000  # 每批的目标字符数
+_jieba_config = None  # 当前进程已生效的 (cache_file, user_dicts)
+_jieba_pools = {}  # (进程数, init_jieba参数) → ProcessPoolExecutor
+
+def init_jieba(cache_file=None, user_dicts=()):
+    '''
+    初始化jieba：前缀词典只构建一次并缓存到磁盘，之后的进程直接加载缓存；并加载用户词典。
+    同一进程内以相同参数重复调用不做任何事。
+    
+    参数：
+        cache_file: 前缀词典缓存文件路径；为None时使用jieba默认位置（系统临时目录下的jieba.cache）
+        user_dicts: 用户词典文件路径列表（格式同jieba.load_userdict）
+    
+    示例：
+        >>> init_jieba('./cache/jieba.cache', ['./userdict.txt'])
+    '''
+    global _jieba_config
+    config = (cache_file, tuple(user_dicts))
+    if _jieba_config == config:
+        return
+    if _jieba_config is not None:
+        jieba.dt.initialized = False  # 更换了词典配置，重新加载
+    if cache_file:
+        # jieba将cache_file拼接在系统临时目录下，相对路径须先转为绝对路径
+        cache_file = os.path.abspath(cache_file)
+        Path(cache_file).parent.mkdir(parents=True, exist_ok=True)
+        jieba.dt.cache_file = cache_file
+    jieba.setLogLevel(60)  # 不输出"Building prefix dict"等日志
+    jieba.initialize()
+    for user_dict in user_dicts:
+        jieba.load_userdict(str(user_dict))
+    _jieba_config = config
+
+def split_zh_batches(text, batch_chars=ZH_BATCH_CHARS):
+    '''
+    在句末标点之后将中文文本切成约batch_chars字符的若干批，各批拼接即为原文。
+    
+    jieba先按汉字/字母数字块切分文本，标点不属于任何块，因此在句末标点之后切开不会改变分词结果：
+    各批分别jieba.lcut后依次拼接，与对整篇文本jieba.lcut的结果一致。
+    '''
+    start = 0
+    for m in ZH_SENTENCE_END.finditer(text):
+        if m.end() - start >= batch_chars:
+            yield text[start:m.end()]
+            start = m.end()
+    if start < len(text):
+        yield text[start:]
+
+def segment_zh(text, workers=1, batch_chars=ZH_BATCH_CHARS):
+    '''
+    中文精确分词，结果与jieba.lcut(text)完全一致。
+    
+    workers大于1且文本较长时，按句末标点分批，在进程池中并行分词（进程池按进程数和init_jieba参数缓存复用，
+    工作进程用与主进程相同的init_jieba参数初始化，从磁盘缓存加载词典；参数变化时旧的进程池被关闭，
+    退出时由shutdown_jieba_pools关闭）。
     
-    # 2. 计算前n个高频词（复用原逻辑）
-    fdist = nltk.FreqDist(tokens)
+    参数：
+        text: 中文文本
+        workers: 进程数（默认1，即在当前进程中分词）
+        batch_chars: 每批的目标字符数
+    返回：
+        列表：jieba分词结果（未过滤空白token）
+    '''
+    init_jieba(*(_jieba_config or ()))
+    if workers <= 1 or len(text) < 2 * batch_chars:
+        return jieba.lcut(text)
+
+    pool = _jieba_pools.get((workers, _jieba_config))
+    if pool is None:
+        for key in [key for key in _jieba_pools if key[1] != _jieba_config]:  # 词典配置已变化
+            _jieba_pools.pop(key).shutdown()
+        pool = _jieba_pools[workers, _jieba_config] = ProcessPoolExecutor(
+            max_workers=workers, initializer=init_jieba, initargs=_jieba_config)
+    tokens = []
+    for batch_tokens in pool.map(_segment_batch, split_zh_batches(text, batch_chars), chunksize=4):
+        tokens.extend(batch_tokens)
+    return tokens
+
+def shutdown_jieba_pools():
+    """关闭segment_zh缓存的所有进程池（进程退出时自动调用）"""
+    while _jieba_pools:
+        _jieba_pools.popitem()[1].shutdown()
+
+atexit.register(shutdown_jieba_pools)
+
+def _segment_batch(batch):
+    """工作进程中对一批文本分词"""
+    return jieba.lcut(batch)
+
+def summarize_counts(fdist, n=10, k=10):
+    '''
+    由词频表计算前n个高频词和长度最长的k个词
+    
+    参数：
+        fdist: nltk.FreqDist（或Counter），可由多个文本块的token逐块update累计得到
+        n: 高频词数量（默认10）
+        k: 最长词数量（默认10）
+    返回：
+        元组 (top_n_words, longest_k_words)，格式同get_statistics
+    '''
+    # 1. 计算前n个高频词：Counter.most_common(n)内部即用大小为n的堆选取，
+    #    频率相同的词按首次出现的顺序排列
     top_n_words = fdist.most_common(n)  # 格式：[(词1, 频率1), (词2, 频率2), ...]
     
-    # 3. 计算长度最长的k个词（去重后按长度排序）
-    unique_tokens = list(set(tokens))  # 去重，避免重复词占据位置
-    # 按长度降序排序（长度相同则按词的字母/字符顺序排序，保证稳定性）
-    sorted_by_length = sorted(
-        unique_tokens,
-        key=lambda x: (-len(x), x)  # 先按长度的负数（降序），再按词本身（升序）
-    )
-    # 取前k个，并添加长度信息
-    longest_k_words = [(word, len(word)) for word in sorted_by_length[:k]]
+    # 2. 计算长度最长的k个词（词频表的键即去重后的词）
+    # 用大小为k的堆选取，不再对全部词排序；排序键与原来相同：
+    # 先按长度的负数（降序），再按词本身（升序），结果与sorted(...)[:k]一致
+    longest = heapq.nsmallest(k, fdist.keys(), key=lambda x: (-len(x), x))
+    longest_k_words = [(word, len(word)) for word in longest]
     
     return (top_n_words, longest_k_words)
 
+class TokenStatistics:
+    """
+    可合并的词频统计：按块或按书累计token计数，再合并为整个语料的统计结果，无需重新分词。
+    
+    合并按顺序进行时，频率相同的词仍按在合并后的token流中首次出现的顺序排列，
+    因此逐块统计再合并的结果与对整篇文本调用get_statistics一致。
+    
+    示例：
+        >>> stats = TokenStatistics(['a', 'b', 'a'])
+        >>> stats.merge(TokenStatistics(['c', 'b']))
+        >>> stats.summarize(n=2, k=1)
+        ([('a', 2), ('b', 2)], [('a', 1)])
+    """
+    def __init__(self, tokens=()):
+        self.fdist = nltk.FreqDist()
+        self.update(tokens)
+
+    def update(self, tokens):
+        """累计一批token（如一个文本块的分词结果）"""
+        self.fdist.update(tokens)
+        return self
+
+    def merge(self, other):
+        """并入另一个统计对象（如另一块或另一本书），返回自身"""
+        self.fdist.update(other.fdist)
+        return self
+
+    def __add__(self, other):
+        return TokenStatistics().merge(self).merge(other)
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __len__(self):
+        return self.fdist.N()  # token总数
+
+    def summarize(self, n=10, k=10):
+        """返回 (top_n_words, longest_k_words)，格式同get_statistics"""
+        return summarize_counts(self.fdist, n=n, k=k)
+
+# 古腾堡URL下载：asyncio控制并发，requests.Session复用连接，磁盘缓存支持条件请求
+DOWNLOAD_DIR = './data/downloads'
+
+def is_url(path):
+    """判断书单中的路径是否为http(s) URL"""
+    return isinstance(path, str) and path.startswith(('http://', 'https://'))
+
+def url_cache_path(url, cache_dir=DOWNLOAD_DIR):
+    """URL在下载缓存中的本地路径：<原文件名>-<URL哈希>.txt（保留.txt后缀，便于fetch_gutenberg_text读取）"""
+    stem = Path(urlparse(url).path).stem or 'index'
+    digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:10]
+    return str(Path(cache_dir) / f"{stem}-{digest}.txt")
+
+def make_download_session(concurrency=4):
+    """创建连接池大小与并发数一致的requests.Session"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def _download_once(session, url, path, timeout):
+    """
+    下载一次URL到path：若已有缓存，带上If-None-Match/If-Modified-Since做条件请求，
+    服务器返回304时直接使用缓存。返回 (状态, 说明)，状态为'cached'/'downloaded'/'retry'/'failed'
+    """
+    meta_path = f"{path}.json"
+    headers = {}
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    try:
+        response = session.get(url, headers=headers, timeout=timeout)
+    except requests.RequestException as e:
+        return 'retry', f"{type(e).__name__}"
+    if response.status_code == 304:
+        return 'cached', "未修改，使用缓存"
+    if response.status_code == 429 or response.status_code >= 500:
+        return 'retry', f"HTTP {response.status_code}"
+    if response.status_code != 200:
+        return 'failed', f"HTTP {response.status_code}"
+
+    # 先写临时文件再替换，中断时不会留下不完整的缓存
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{path}.tmp", 'wb') as f:
+        f.write(response.content)
+    os.replace(f"{path}.tmp", path)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'url': url, 'etag': response.headers.get('ETag'),
+                   'last_modified': response.headers.get('Last-Modified')}, f)
+    return 'downloaded', f"{len(response.content)}字节"
+
+async def download_url(url, session, semaphore, cache_dir=DOWNLOAD_DIR, retries=3, timeout=30, backoff=1.0):
+    """
+    下载单个URL到磁盘缓存（供download_gutenberg_texts和后台预取共用），返回 (本地路径或None, 提示信息或None)。
+    连接错误、超时、429或5xx时最多重试retries次（指数退避：backoff, 2*backoff, ...）；
+    下载失败但已有旧缓存时退回到旧缓存。
+    """
+    path = url_cache_path(url, cache_dir)
+    async with semaphore:
+        for attempt in range(retries + 1):
+            # requests为阻塞调用，放到线程中执行；并发度由semaphore限制
+            status, detail = await asyncio.to_thread(_download_once, session, url, path, timeout)
+            if status != 'retry' or attempt == retries:
+                break
+            await asyncio.sleep(backoff * 2 ** attempt)
+    if status in ('cached', 'downloaded'):
+        return path, None
+    if os.path.exists(path):  # 网络不可用时退回到旧的缓存
+        return path, f"警告：下载 {url} 失败（{detail}），使用已缓存的版本"
+    return None, f"错误：下载 {url} 失败（{detail}）"
+
+async def download_gutenberg_texts(urls, cache_dir=DOWNLOAD_DIR, concurrency=4, retries=3,
+                                   timeout=30, backoff=1.0, session=None):
+    """
+    并发下载多个古腾堡文本到磁盘缓存，返回 {url: 本地路径或None}。
+    
+    参数：
+        urls: URL列表
+        cache_dir: 下载缓存目录（每个文件旁保存ETag/Last-Modified，下次为条件请求）
+        concurrency: 最大并发请求数（同时也是连接池大小）
+        retries: 连接错误、超时、429或5xx时的重试次数
+        timeout: 单次请求超时（秒）
+        backoff: 首次重试前的等待时间（秒），之后每次加倍
+        session: 可选的requests.Session（默认按concurrency新建）
+    
+    示例：
+        >>> paths = asyncio.run(download_gutenberg_texts(['https://www.gutenberg.org/files/1342/1342-0.txt']))
+    """
+    session = session or make_download_session(concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    results = await asyncio.gather(*(
+        download_url(url, session, semaphore, cache_dir, retries, timeout, backoff) for url in urls))
+    paths = {}
+    for url, (path, message) in zip(urls, results):
+        if message:
+            print(message)
+        paths[url] = path
+    return paths
+
+def download_gutenberg_text(url, cache_dir=DOWNLOAD_DIR, **kwargs):
+    """下载单个古腾堡URL（同步接口），返回本地缓存路径；失败时返回None"""
+    return asyncio.run(download_gutenberg_texts([url], cache_dir=cache_dir, **kwargs))[url]
+
 def fetch_gutenberg_text(file_path=None):
     """
     读取本地古腾堡txt文件，提取正文内容（去除首尾元数据标记）
@@ -110,42 +544,44 @@ def fetch_gutenberg_text(file_path=None):
         >>> print(content[:500])  # 打印正文前500字符
            
     说明: 
-        你可以自己实现输入 fetch_gutenberg_text(link='https://www.gutenberg.org/files/1342/1342-0.txt'):
+        file_path也可以是古腾堡URL，此时先下载到DOWNLOAD_DIR（已缓存且未修改时不重新下载）:
         >>> content = fetch_gutenberg_text('https://www.gutenberg.org/files/1342/1342-0.txt')
         >>> print(content[:500])  # 打印正文前500字符
     """
+    if is_url(file_path):
+        print(f"正在下载：{file_path}")
+        file_path = download_gutenberg_text(file_path)
+        if not file_path:
+            return None
+
     # 1. 验证文件格式（仅支持txt）
     if not file_path.endswith('.txt'):
         print(f"错误：{file_path} 不是.txt格式文件，仅支持文本文件")
         return None
 
-    # 2. 正则匹配古腾堡标准标记（提取正文核心）
-    # 匹配 "*** START OF THE PROJECT GUTENBERG EBOOK ... ***" 及变体
-    start_pat = re.compile(
-        r'\*{3}\s+START OF (?:THE|THIS)?\s+PROJECT GUTENBERG EBOOK.*?\*{3}',
-        re.IGNORECASE | re.DOTALL
-    )
-    # 匹配 "*** END OF THE PROJECT GUTENBERG EBOOK ... ***" 及变体
-    end_pat = re.compile(
-        r'\*{3}\s+END OF (?:THE|THIS)?\s+PROJECT GUTENBERG EBOOK.*?\*{3}',
-        re.IGNORECASE | re.DOTALL
-    )
-
-    # 3. 读取本地文件（适配古腾堡常见编码：utf-8 / latin-1）
+    # 2. 映射本地文件并在字节层面定位古腾堡标记，只解码正文部分
+    #    （编码判定同整篇读取：全文为合法utf-8则用utf-8，否则用latin-1）
     try:
         print(f"正在读取本地文件：{file_path}")
         
-        # 优先尝试utf-8编码（古腾堡现代文本常用）
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
-            print("文件编码：utf-8（读取成功）")
-        
-        # 若utf-8解码失败，尝试latin-1（古腾堡早期英文文本常用）
-        except UnicodeDecodeError:
-            with open(file_path, 'r', encoding='latin-1') as f:
-                text = f.read()
-            print("文件编码：latin-1（读取成功）")
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            # 空文件无法映射，按无标记处理
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+            try:
+                start_match = _search_marker(data, _GUTENBERG_START_BYTES)
+                end_match = _search_marker(data, _GUTENBERG_END_BYTES)
+                markers_ok = bool(start_match and end_match and start_match.end() < end_match.start())
+                
+                if markers_ok:
+                    # 标记为ASCII，切分处不会落在多字节字符中间
+                    encoding, text = _decode_body(data, start_match.end(), end_match.start())
+                else:
+                    encoding, text = _detect_file_encoding(file_path), None
+            finally:
+                if size:
+                    data.close()
+        print(f"文件编码：{encoding}（读取成功）")
 
     # 捕获本地文件读取的常见错误
     except FileNotFoundError:
@@ -158,11 +594,7 @@ def fetch_gutenberg_text(file_path=None):
         print(f"错误：读取文件时发生未知错误 - {str(e)[:50]}...")
         return None
 
-    # 4. 提取正文（基于古腾堡标记）
-    start_match = start_pat.search(text)
-    end_match = end_pat.search(text)
-
-    # 处理标记不存在/位置异常的情况
+    # 3. 处理标记不存在/位置异常的情况
     if not start_match:
         print("警告：未找到古腾堡正文开始标记（*** START OF ... ***）")
         # 可选：返回全文（若用户希望保留完整文件内容）
@@ -173,22 +605,235 @@ def fetch_gutenberg_text(file_path=None):
         # 可选：返回开始标记后的内容
         # return text[start_match.end():].strip()
         return None
-    if start_match.end() >= end_match.start():
+    if not markers_ok:
         print("错误：开始标记位置在结束标记之后，无法提取正文")
         return None
 
     # 提取标记间的正文（去除首尾空格）
-    content = text[start_match.end():end_match.start()].strip()
+    content = text.strip()
     print(f"正文提取成功！正文长度：{len(content)} 字符")
     return content
 
-def save_processed_text(original_path, processed_text):
+def _search_marker(data, pattern):
     """
-    将预处理后的文本保存至新文件，命名规则：原文件xxx.txt → xxx-p.txt
+    等价于pattern.search(data)：标记必以'***'开头，先用find快速跳到每个'***'，再在该处尝试匹配
+    """
+    pos = data.find(b'***')
+    while pos != -1:
+        match = pattern.match(data, pos)
+        if match:
+            return match
+        pos = data.find(b'***', pos + 1)
+    return None
+
+def _decode_body(data, start, end):
+    """
+    只解码data[start:end]（正文），并确定整个文件的编码
+    
+    先校验较小的文件头和文件尾是否为合法utf-8，再尝试以utf-8解码正文；
+    任一部分失败则整体按latin-1解码正文（与整篇读取的判定一致）。
+    换行符按文本模式读取的规则统一为\n（\r\n和单独的\r）。
+    
+    返回：
+        元组 (encoding, body_text)
+    """
+    view = memoryview(data)
+    try:
+        try:
+            str(view[:start], 'utf-8')
+            encoding, body = 'utf-8', str(view[start:end], 'utf-8')
+            str(view[end:], 'utf-8')
+        except UnicodeDecodeError:
+            encoding, body = 'latin-1', str(view[start:end], 'latin-1')
+    finally:
+        view.release()
+    if '\r' in body:
+        body = body.replace('\r\n', '\n')
+        if '\r' in body:
+            body = body.replace('\r', '\n')
+    return encoding, body
+
+def scan_gutenberg_text(file_path, chunk_size=65536):
+    """
+    流式扫描本地古腾堡txt文件：确定编码、检查首尾标记、统计正文长度并检测语言，不将全文读入内存
     
     参数：
-        original_path (str): 原文件路径（如 './data/1342-0.txt'）
-        processed_text (str): 预处理后的文本内容
+        file_path (str): 本地txt文件路径
+        chunk_size (int): 每个文本块的目标字符数（按段落边界切分）
+    
+    返回：
+        dict: {'encoding': 编码, 'lang': 语言, 'length': 正文字符数}；
+              若文件读取失败/无有效标记，返回None（提示信息与fetch_gutenberg_text一致）
+    
+    示例：
+        >>> info = scan_gutenberg_text('./data/1342-0.txt')
+        >>> chunks = iter_gutenberg_text('./data/1342-0.txt', encoding=info['encoding'])
+    """
+    # 1. 验证文件格式（仅支持txt）
+    if not file_path.endswith('.txt'):
+        print(f"错误：{file_path} 不是.txt格式文件，仅支持文本文件")
+        return None
+
+    # 2. 确定文件编码，并逐块检测语言
+    markers = {}
+    try:
+        print(f"正在读取本地文件：{file_path}")
+        encoding = _detect_file_encoding(file_path)
+        print(f"文件编码：{encoding}（读取成功）")
+        with open(file_path, 'r', encoding=encoding) as f:
+            lang, length = detect_language_chunks(
+                _iter_gutenberg_chunks(f, chunk_size, markers))
+
+    # 捕获本地文件读取的常见错误
+    except FileNotFoundError:
+        print(f"错误：文件 {file_path} 不存在，请检查路径是否正确")
+        return None
+    except PermissionError:
+        print(f"错误：无权限读取文件 {file_path}，请检查文件权限")
+        return None
+    except Exception as e:
+        print(f"错误：读取文件时发生未知错误 - {str(e)[:50]}...")
+        return None
+
+    # 3. 处理标记不存在的情况
+    if not markers.get('start'):
+        print("警告：未找到古腾堡正文开始标记（*** START OF ... ***）")
+        return None
+    if not markers.get('end'):
+        print("警告：未找到古腾堡正文结束标记（*** END OF ... ***）")
+        return None
+    if markers.get('order') is False:
+        print("错误：开始标记位置在结束标记之后，无法提取正文")
+        return None
+
+    print(f"正文提取成功！正文长度：{length} 字符")
+    return {'encoding': encoding, 'lang': lang, 'length': length}
+
+def iter_gutenberg_text(file_path, encoding='utf-8', chunk_size=65536):
+    """
+    按段落大小的文本块逐块读取古腾堡正文（生成器），内存占用与文件大小无关
+    
+    参数：
+        file_path (str): 本地txt文件路径
+        encoding (str): 文件编码，通常取scan_gutenberg_text返回的'encoding'
+        chunk_size (int): 每个文本块的目标字符数，仅在空行（段落边界）处切分
+    
+    返回：
+        生成器：文本块依次拼接后等于fetch_gutenberg_text(file_path)的返回值
+    """
+    with open(file_path, 'r', encoding=encoding) as f:
+        yield from _iter_gutenberg_chunks(f, chunk_size, {})
+
+def _detect_file_encoding(file_path, block_size=1 << 20):
+    """逐块校验文件是否为合法utf-8，否则回退为latin-1（与fetch_gutenberg_text的判定一致）"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with open(file_path, 'rb') as f:
+        try:
+            for block in iter(lambda: f.read(block_size), b''):
+                decoder.decode(block)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            return 'latin-1'
+    return 'utf-8'
+
+MARKER_LOOKBACK_CHARS = 4096  # 流式读取时首尾标记（可跨行）在其结尾之前最多跨越的字符数
+
+def _gutenberg_body_lines(f, markers):
+    """
+    从已打开的文本文件中逐行产出首尾标记之间的正文（生成器）
+    
+    首尾标记与fetch_gutenberg_text使用同一正则（GUTENBERG_START_PAT/GUTENBERG_END_PAT）。
+    标记的结尾'***'必在某一行之内，因此只在读入含'***'的行时，在最近MARKER_LOOKBACK_CHARS个字符
+    （按整行保留）的窗口内匹配：耗时与文件大小成线性，缓冲的文件头和尚未产出的正文均不超过该窗口。
+    
+    markers字典会被写入'start'/'end'两个布尔值，表示是否找到对应标记；
+    若结束标记出现在开始标记之前（或紧接开始标记、正文为空），另写入'order': False（此时不产出正文），
+    与fetch_gutenberg_text要求start.end() < end.start()一致。
+    """
+    window, size = collections.deque(), 0  # 最近读入的行及其总字符数
+    head = 0  # 窗口开头属于文件头（开始标记及之前）的字符数，这部分不产出
+
+    def trim():
+        nonlocal size, head
+        while len(window) > 1 and size - len(window[0]) >= MARKER_LOOKBACK_CHARS:
+            line = window.popleft()
+            size -= len(line)
+            if head < len(line):
+                yield line[head:]
+            head = max(head - len(line), 0)
+
+    # 1. 定位开始标记；同时记录是否已先出现结束标记（整篇读取时即为"开始标记在结束标记之后"）
+    start_match, end_first = None, False
+    for line in f:
+        window.append(line)
+        size += len(line)
+        if '***' in line:
+            text = ''.join(window)
+            start_match = GUTENBERG_START_PAT.search(text)
+            end_match = GUTENBERG_END_PAT.search(text)
+            if end_match and (not start_match or end_match.start() <= start_match.end()):
+                end_first = True
+            if start_match:
+                break
+        for _ in trim():  # 文件头只需保留窗口内的部分
+            pass
+    markers['start'] = start_match is not None
+    markers['end'] = end_first
+    if not start_match:
+        return
+    if end_first:
+        markers['order'] = False
+        return
+
+    # 2. 开始标记的结尾在当前行内，其后即为正文；正文行离开窗口后才产出，以便截去结束标记。
+    #    窗口保留开始标记，结束标记与之重叠时与整篇读取一样视为顺序错误
+    head = start_match.end()
+    for line in itertools.chain([None], f):  # None：开始标记所在的行，已在窗口中
+        if line is None:
+            line = window[-1]
+        else:
+            window.append(line)
+            size += len(line)
+        if '***' in line:
+            text = ''.join(window)
+            end_match = GUTENBERG_END_PAT.search(text)
+            if end_match:
+                markers['end'] = True
+                if end_match.start() <= head:  # 与整篇读取相同：正文为空也视为顺序错误
+                    markers['order'] = False
+                    return
+                yield from text[head:end_match.start()].splitlines(keepends=True)
+                return
+        yield from trim()
+    yield ''.join(window)[head:]  # 未找到结束标记（markers['end']为False）
+
+def _iter_gutenberg_chunks(f, chunk_size, markers):
+    """
+    从已打开的文本文件中读取首尾标记之间的正文（见_gutenberg_body_lines），并按段落边界产出正文文本块
+    """
+    pending = None  # 延迟一块产出，以便去除正文末尾空白
+    buf, size = [], 0
+    for line in _gutenberg_body_lines(f, markers):
+        if not buf and pending is None:
+            line = line.lstrip()  # 去除正文开头空白
+        if line:
+            buf.append(line)
+            size += len(line)
+        if size >= chunk_size and not line.strip():
+            if pending is not None:
+                yield pending
+            pending, buf, size = ''.join(buf), [], 0
+
+    # 产出剩余正文（去除正文末尾空白，与整篇读取的strip一致）
+    tail = ''.join(buf).rstrip()
+    if pending is not None:
+        yield pending if tail else pending.rstrip()
+    if tail:
+        yield tail
+
+def get_processed_path(original_path):
+    """
+    生成预处理结果的保存路径，命名规则：原文件xxx.txt → xxx-p.txt（与原文件同目录）
     """
     # 转换为Path对象，方便处理路径
     orig_path = Path(original_path)
@@ -197,7 +842,17 @@ def save_processed_text(original_path, processed_text):
     new_filename = f"{orig_path.stem}-p{orig_path.suffix}"  # 如 "1342-0-p.txt"
     
     # 构建新文件的完整路径（与原文件同目录）
-    new_path = orig_path.parent / new_filename  # 如 './data/1342-0-p.txt'
+    return orig_path.parent / new_filename  # 如 './data/1342-0-p.txt'
+
+def save_processed_text(original_path, processed_text):
+    """
+    将预处理后的文本保存至新文件，命名规则：原文件xxx.txt → xxx-p.txt
+    
+    参数：
+        original_path (str): 原文件路径（如 './data/1342-0.txt'）
+        processed_text (str): 预处理后的文本内容
+    """
+    new_path = get_processed_path(original_path)
     
     try:
         # 确保目标目录存在（若不存在则创建）
@@ -211,6 +866,429 @@ def save_processed_text(original_path, processed_text):
     except Exception as e:
         print(f"❌ 保存文件失败 {new_path}：{str(e)}")
 
+def save_processed_stream(original_path, processed_chunks, verbose=True):
+    """
+    流式保存预处理结果：逐块写入xxx-p.txt，块之间以空格相连，空块跳过
+    
+    参数：
+        original_path (str): 原文件路径（如 './data/1342-0.txt'）
+        processed_chunks (iterable): 预处理后的文本块（如normalize_doc_stream产出的文本）
+        verbose (bool): 是否打印保存结果
+    
+    返回：
+        int: 写入的字符数；保存失败（文件无法打开或写入）时返回None。
+        预处理中的异常（迭代processed_chunks时引发）不在此处理，直接向上传播。
+    """
+    new_path = get_processed_path(original_path)
+    
+    try:
+        new_path.parent.mkdir(parents=True, exist_ok=True)
+        f = open(new_path, 'w', encoding='utf-8')
+    except OSError as e:
+        print(f"❌ 保存文件失败 {new_path}：{str(e)}")
+        return None
+    
+    written = 0
+    try:
+        with f:
+            for chunk in processed_chunks:
+                if not chunk:
+                    continue
+                try:
+                    if written:
+                        f.write(' ')
+                        written += 1
+                    f.write(chunk)
+                    written += len(chunk)
+                except OSError as e:
+                    print(f"❌ 保存文件失败 {new_path}：{str(e)}")
+                    return None
+    except BaseException:
+        new_path.unlink(missing_ok=True)  # 预处理出错，不留下只写了一部分的xxx-p.txt
+        raise
+    
+    if verbose:
+        print(f"✅ 预处理文本已保存至：{new_path}")
+    return written
+
+# token id二进制输出：词表 + 扁平的uint32 token id数组 + 文档（段落块）偏移数组，
+# 可用numpy.memmap零拷贝读取，后续统计与训练数据加载不必重新分词
+TOKEN_ID_DTYPE = 'uint32'
+TOKEN_ID_FILES = ('vocab', 'ids', 'offsets')  # get_token_id_paths的各文件
+TOKEN_OFFSET_DTYPE = 'int64'
+
+def get_token_id_paths(original_path):
+    """
+    生成token id文件的保存路径（与xxx-p.txt同目录）：
+        vocab: xxx-p.vocab.txt，每行一个词，行号即id
+        ids: xxx-p.ids.u32，所有token的id依次排列（uint32，本机字节序）
+        offsets: xxx-p.offsets.i64，第i个文档的token为ids[offsets[i]:offsets[i+1]]（int64，长度为文档数+1）
+    """
+    processed = get_processed_path(original_path)
+    stem = processed.parent / processed.stem
+    return {'vocab': Path(f"{stem}.vocab.txt"), 'ids': Path(f"{stem}.ids.u32"),
+            'offsets': Path(f"{stem}.offsets.i64")}
+
+class TokenIdWriter:
+    """
+    逐文档写出token id文件：add(tokens)将一个文档（整本书或流式处理的一个段落块）的token
+    转为id追加到ids文件，close()时写出偏移数组和词表。id按词首次出现的顺序分配。
+    各文件先写入.tmp，全部完成后才改名，中断（异常或调用discard()）时不会留下不完整的输出。
+
+    示例：
+        >>> with TokenIdWriter('./data/8001.txt') as writer:
+        ...     for tokens in docs:
+        ...         writer.add(tokens)
+    """
+    def __init__(self, original_path):
+        self.paths = get_token_id_paths(original_path)
+        self.index = {}  # 词 → id
+        self.offsets = [0]
+        self._ids_file = None
+        self._discarded = False
+
+    def __enter__(self):
+        self.paths['ids'].parent.mkdir(parents=True, exist_ok=True)
+        self._ids_file = open(f"{self.paths['ids']}.tmp", 'wb')
+        return self
+
+    def add(self, tokens):
+        index = self.index
+        ids = np.fromiter((index.setdefault(token, len(index)) for token in tokens), dtype=TOKEN_ID_DTYPE)
+        ids.tofile(self._ids_file)
+        self.offsets.append(self.offsets[-1] + len(ids))
+
+    def close(self):
+        self._ids_file.close()
+        np.asarray(self.offsets, dtype=TOKEN_OFFSET_DTYPE).tofile(f"{self.paths['offsets']}.tmp")
+        with open(f"{self.paths['vocab']}.tmp", 'w', encoding='utf-8') as f:
+            f.writelines(f"{word}\n" for word in self.index)  # dict按插入顺序，即id顺序
+        for path in self.paths.values():
+            os.replace(f"{path}.tmp", path)
+
+    def discard(self):
+        """放弃本次输出（如对应的xxx-p.txt保存失败）：退出with块时删除临时文件，不覆盖已有的token id文件"""
+        self._discarded = True
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and not self._discarded:
+            self.close()
+        else:
+            self._ids_file.close()
+            for path in self.paths.values():
+                Path(f"{path}.tmp").unlink(missing_ok=True)
+        return False
+
+def save_token_ids(original_path, docs, verbose=True):
+    """
+    将预处理后的token保存为token id文件（见get_token_id_paths），与save_processed_text并列使用
+
+    参数：
+        original_path (str): 原文件路径（如 './data/1342-0.txt'）
+        docs (iterable): 文档序列，每个文档为一个token列表
+        verbose (bool): 是否打印保存结果
+
+    返回：
+        dict: 词表大小、token数和文档数；保存失败时返回None
+    """
+    paths = get_token_id_paths(original_path)
+    try:
+        with TokenIdWriter(original_path) as writer:
+            for tokens in docs:
+                writer.add(tokens)
+        if verbose:
+            print(f"✅ token id已保存至：{paths['ids']}（词表{len(writer.index)}词，{writer.offsets[-1]}个token）")
+        return {'vocab_size': len(writer.index), 'n_tokens': writer.offsets[-1], 'n_docs': len(writer.offsets) - 1}
+    except Exception as e:
+        print(f"❌ 保存文件失败 {paths['ids']}：{str(e)}")
+        return None
+
+def restore_token_ids(original_path, cached_files, verbose=True):
+    """
+    由缓存的token id文件（load_cached_result返回的'token_id_files'）恢复original_path对应的token id文件，
+    不重新分词，结果与首次处理时写出的文件相同
+
+    返回：
+        dict: 词表大小和token数；恢复失败时返回None
+    """
+    paths = get_token_id_paths(original_path)
+    try:
+        for name in TOKEN_ID_FILES:
+            shutil.copyfile(cached_files[name], paths[name])
+        with open(paths['vocab'], 'r', encoding='utf-8') as f:
+            vocab_size = sum(1 for _ in f)
+        n_tokens = paths['ids'].stat().st_size // np.dtype(TOKEN_ID_DTYPE).itemsize
+    except Exception as e:
+        print(f"❌ 保存文件失败 {paths['ids']}：{str(e)}")
+        return None
+    if verbose:
+        print(f"✅ token id已保存至：{paths['ids']}（词表{vocab_size}词，{n_tokens}个token）")
+    return {'vocab_size': vocab_size, 'n_tokens': n_tokens}
+
+def load_token_ids(original_path):
+    """
+    读取save_token_ids/TokenIdWriter写出的token id文件，ids和offsets以numpy.memmap只读映射（不复制数据）
+
+    参数：
+        original_path (str): 原文件路径（如 './data/1342-0.txt'）
+
+    返回：
+        元组 (vocab, ids, offsets)：vocab为词列表（vocab[id]即词），
+        第i个文档的token id为ids[offsets[i]:offsets[i+1]]
+    """
+    paths = get_token_id_paths(original_path)
+    with open(paths['vocab'], 'r', encoding='utf-8') as f:
+        vocab = f.read().split('\n')[:-1]
+    def memmap(path, dtype):
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)  # 空文件无法映射
+        return np.memmap(path, dtype=dtype, mode='r')
+    return vocab, memmap(paths['ids'], TOKEN_ID_DTYPE), memmap(paths['offsets'], TOKEN_OFFSET_DTYPE)
+
+def _top_ids(scores, n):
+    """
+    选出scores最大的n个下标：先用argpartition取候选，再补齐与第n名并列的下标，
+    结果按分数降序、并列时按下标升序排列（下标即首次出现顺序，与Counter.most_common一致）
+    """
+    if n <= 0 or not len(scores):
+        return np.zeros(0, dtype=np.int64)
+    if n < len(scores):
+        threshold = scores[np.argpartition(-scores, n - 1)[:n]].min()
+        above = np.flatnonzero(scores > threshold)
+        tied = np.flatnonzero(scores == threshold)[:n - len(above)]
+        idx = np.concatenate([above, tied])
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.lexsort((idx, -scores[idx]))]
+
+class CorpusStatistics:
+    """
+    基于token id数组的向量化语料统计（numpy）：各书籍的词频由np.bincount计算，
+    最长词由预先计算的词长数组经argpartition选取，另提供类符/形符比、只出现一次的词（hapax）数
+    以及书籍×词的词频矩阵。
+
+    各书籍的词表合并为语料词表（按在书单顺序的token流中首次出现的顺序编号）；
+    频率相同的词按首次出现的顺序排列，因此整个语料或单本书的summarize结果
+    与对同样的token调用get_statistics/TokenStatistics一致。
+
+    示例：
+        >>> corpus = CorpusStatistics().add_tokens('a', ['x', 'yy', 'x']).add_tokens('b', ['yy', 'zzz'])
+        >>> corpus.summarize(n=2, k=1)
+        ([('x', 2), ('yy', 2)], [('zzz', 3)])
+        >>> corpus.summary('a')['hapax']
+        1
+    """
+    def __init__(self):
+        self.vocab = []   # 语料词表：id → 词
+        self.index = {}   # 词 → id
+        self.books = []   # 书名
+        self._books = []  # 各书籍的 (书籍词表id → 语料词表id, 书籍词表上的词频数组)
+        self._lengths = None
+
+    @classmethod
+    def from_token_files(cls, book_paths):
+        """由 {书名: 原文件路径} 中各书籍的token id文件（见save_token_ids）构建，缺少文件的书籍跳过"""
+        corpus = cls()
+        for name, path in book_paths.items():
+            try:
+                vocab, ids, _ = load_token_ids(path)
+            except OSError:
+                continue
+            corpus.add_book(name, vocab, ids)
+        return corpus
+
+    def add_book(self, name, vocab, ids):
+        """加入一本书：vocab为该书的词表（按首次出现顺序），ids为其token id数组（可为memmap）；返回自身"""
+        index, known = self.index, len(self.index)
+        remap = np.fromiter((index.setdefault(word, len(index)) for word in vocab),
+                            dtype=np.int64, count=len(vocab))
+        self.vocab.extend(vocab[i] for i in np.flatnonzero(remap >= known))  # 新词的id依次递增
+        counts = np.bincount(np.asarray(ids, dtype=np.int64), minlength=len(vocab))
+        self.books.append(name)
+        self._books.append((remap, counts))
+        return self
+
+    def add_tokens(self, name, tokens):
+        """由token列表加入一本书；返回自身"""
+        vocab = {}
+        ids = np.fromiter((vocab.setdefault(token, len(vocab)) for token in tokens), dtype=np.int64)
+        return self.add_book(name, list(vocab), ids)
+
+    @property
+    def lengths(self):
+        """语料词表中各词的长度（字符数）"""
+        if self._lengths is None or len(self._lengths) != len(self.vocab):
+            self._lengths = np.fromiter(map(len, self.vocab), dtype=np.int64, count=len(self.vocab))
+        return self._lengths
+
+    def frequency_matrix(self):
+        """返回书籍×词的词频矩阵（形状为 (书籍数, 词表大小)，行顺序同self.books，列顺序同self.vocab）"""
+        matrix = np.zeros((len(self.books), len(self.vocab)), dtype=np.int64)
+        for row, (remap, counts) in enumerate(self._books):
+            matrix[row, remap] = counts
+        return matrix
+
+    def counts(self, book=None):
+        """某本书（book为书名）或整个语料（book为None）的词频数组，下标为语料词表id"""
+        total = np.zeros(len(self.vocab), dtype=np.int64)
+        for remap, counts in self._select(book):
+            total[remap] += counts
+        return total
+
+    def _select(self, book):
+        return self._books if book is None else [self._books[self.books.index(book)]]
+
+    def summarize(self, n=10, k=10, book=None):
+        """返回 (top_n_words, longest_k_words)，格式同get_statistics；book为None时统计整个语料"""
+        if book is None:
+            ids, counts = np.arange(len(self.vocab)), self.counts()
+        else:
+            ids, counts = self._select(book)[0]  # 在书籍词表上统计，并列时按该书中的首次出现顺序
+        top_n_words = [(self.vocab[ids[i]], int(counts[i])) for i in _top_ids(counts, n)]
+
+        # 最长词：只在出现过的词中选；先按长度选出候选（含与第k名等长的词），再按 (-长度, 词) 排序
+        present = ids[counts > 0]
+        lengths = self.lengths[present]
+        candidates = present[_top_ids(lengths, k)]
+        if len(candidates):
+            candidates = present[lengths >= self.lengths[candidates[-1]]]
+        longest = sorted((self.vocab[i] for i in candidates), key=lambda x: (-len(x), x))[:k]
+        longest_k_words = [(word, len(word)) for word in longest]
+        return (top_n_words, longest_k_words)
+
+    def summary(self, book=None):
+        """某本书或整个语料的概要：token数、词型数、类符/形符比（TTR）和只出现一次的词数（hapax）"""
+        counts = self.counts(book)
+        n_tokens = int(counts.sum())
+        n_types = int(np.count_nonzero(counts))
+        return {'tokens': n_tokens, 'types': n_types,
+                'ttr': n_types / n_tokens if n_tokens else 0.0,
+                'hapax': int(np.count_nonzero(counts == 1))}
+
+    def save(self, path):
+        """将书名、词表和词频矩阵保存为.npz（用np.load读取）"""
+        np.savez_compressed(path, books=np.array(self.books, dtype=str), vocab=np.array(self.vocab, dtype=str),
+                            matrix=self.frequency_matrix())
+
+# 预处理结果缓存：键为源文件内容、规范化后的预处理参数和流水线版本的哈希
+PREPROCESS_CACHE_VERSION = 1  # 预处理流程的输出格式变化时递增，使旧缓存失效
+
+def file_digest(file_path, block_size=1 << 20):
+    """
+    逐块计算文件内容的sha256摘要（不将文件整体读入内存）
+    
+    返回：
+        str: 十六进制摘要；文件无法读取时返回None
+    """
+    h = hashlib.sha256()
+    try:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                h.update(block)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+def preprocess_cache_key(file_path, params, code_files=()):
+    """
+    计算预处理结果的缓存键
+    
+    参数：
+        file_path (str): 源文件路径（按内容而非路径计算哈希）
+        params (dict): 规范化后的预处理参数（已补全默认值，键顺序无关）
+        code_files (iterable): 预处理流程的源码文件（如Assign1_func.py），修改代码后缓存自动失效
+    返回：
+        str: 缓存键；源文件无法读取时返回None
+    """
+    source_digest = file_digest(file_path)
+    if source_digest is None:
+        return None
+    h = hashlib.sha256()
+    h.update(f"v{PREPROCESS_CACHE_VERSION}\n{source_digest}\n".encode('utf-8'))
+    h.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    for code_file in code_files:
+        h.update(f"\n{file_digest(code_file)}".encode('utf-8'))
+    return h.hexdigest()
+
+def load_cached_result(cache_dir, key):
+    """
+    读取缓存的预处理结果
+    
+    返回：
+        dict: 缓存的结果（lang、length、processed_length、top_n、longest_k、errors），
+              以及预处理文本的缓存路径'processed_file'；条目包含token id文件时另有'token_id_files'
+              （vocab/ids/offsets → 缓存路径）；未命中时返回None
+    """
+    meta_path = Path(cache_dir) / f"{key}.json"
+    text_path = Path(cache_dir) / f"{key}.txt"
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not text_path.exists():
+        return None
+    if result.pop('token_ids', False):
+        token_id_files = {name: Path(cache_dir) / f"{key}.{name}" for name in TOKEN_ID_FILES}
+        if not all(path.exists() for path in token_id_files.values()):
+            return None
+        result['token_id_files'] = {name: str(path) for name, path in token_id_files.items()}
+    # 更新访问时间，淘汰时优先删除最久未使用的条目
+    os.utime(meta_path)
+    result['processed_file'] = str(text_path)
+    return result
+
+def store_cached_result(cache_dir, key, result, processed_path, max_bytes=1 << 30, token_id_paths=None):
+    """
+    保存预处理结果到缓存，并按总大小淘汰最久未使用的条目
+    
+    参数：
+        cache_dir (str): 缓存目录
+        key (str): preprocess_cache_key计算的缓存键
+        result (dict): 语言、长度、统计结果和检查结果（需可JSON序列化）
+        processed_path (str): 已保存的xxx-p.txt路径，其内容被复制进缓存
+        max_bytes (int): 缓存目录的大小上限
+        token_id_paths (dict, optional): 已保存的token id文件（get_token_id_paths的返回值），
+                                         一并复制进缓存，命中时原样恢复而不重新分词
+    """
+    cache_dir = Path(cache_dir)
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(processed_path, cache_dir / f"{key}.txt")
+        if token_id_paths:
+            for name in TOKEN_ID_FILES:
+                shutil.copyfile(token_id_paths[name], cache_dir / f"{key}.{name}")
+            result = dict(result, token_ids=True)
+        # 元数据最后写入：只有文本和元数据都完整时才视为命中
+        with open(cache_dir / f"{key}.json", 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False)
+    except Exception as e:
+        print(f"❌ 写入预处理缓存失败 {cache_dir}：{str(e)}")
+        return
+    evict_cache(cache_dir, max_bytes)
+
+def evict_cache(cache_dir, max_bytes):
+    """按最近访问时间从旧到新删除缓存条目，直到缓存总大小不超过max_bytes"""
+    entries = {}
+    for path in Path(cache_dir).glob('*.*'):
+        if path.suffix in ('.json', '.txt') or path.suffix[1:] in TOKEN_ID_FILES:
+            entries.setdefault(path.stem, []).append(path)
+    sizes = {key: sum(p.stat().st_size for p in paths) for key, paths in entries.items()}
+    total = sum(sizes.values())
+    if total <= max_bytes:
+        return
+
+    def last_used(key):
+        meta_path = Path(cache_dir) / f"{key}.json"
+        return meta_path.stat().st_mtime if meta_path.exists() else 0
+
+    for key in sorted(entries, key=last_used):
+        if total <= max_bytes:
+            break
+        for path in entries[key]:
+            path.unlink(missing_ok=True)
+        total -= sizes[key]
+
 def test_english_contractions(processed: str)->list:
     """
     检查处理后的文本中是否仍包含未扩展的英文缩写格式
@@ -218,48 +1296,81 @@ def test_english_contractions(processed: str)->list:
     参数：
         processed: 处理后的文本
     返回：
-        错误列表（包含仍存在的缩写格式）
+        错误列表（包含仍存在的缩写格式，按contractions_dict的顺序）
     """
-    errors = []
     # 统一转为小写检查（忽略大小写影响）
     processed_lower = processed.lower()
     
-    # 遍历contractions包支持的所有缩写
-    for contraction in contractions.contractions_dict.keys():
-        # 1. 检查处理后的文本中是否存在该缩写（完整单词匹配）
-        # 正则： 确保匹配独立单词，re.escape处理特殊字符（如撇号'）
-        contraction_pattern = re.compile(rf'{re.escape(contraction)}')
-        if contraction_pattern.search(processed_lower):
-            # 若存在未扩展的缩写，记录错误
-            errors.append(f"处理后的文本仍包含未扩展的缩写: '{contraction}'")
+    # 单次扫描找出文本中仍存在的所有缩写（完整单词匹配，等价于对每个缩写分别搜索\b缩写\b）
+    pattern, prefixes = _contraction_scanner()
+    found = set()
+    for match in pattern.finditer(processed_lower):
+        found.update(prefixes[match.group(1)])
     
-    return errors
+    # 按contractions包中缩写的顺序记录错误
+    return [f"处理后的文本仍包含未扩展的缩写: '{contraction}'"
+            for contraction in contractions.contractions_dict.keys()
+            if contraction in found]
 
-def test_stopwords(processed:str, lang='en')->list:
+@lru_cache(maxsize=1)
+def _contraction_scanner():
     """
-    假设processed是已经切词用空格分隔连接的字符串
+    构建（并缓存）所有缩写的组合正则，只需扫描一遍文本。
+    
+    零宽前瞻使每个单词边界都被检查；分支按长度降序排列，因此每个位置捕获的是最长的缩写。
+    同一位置上其他匹配的缩写必为该缩写的前缀（且前缀后是单词边界），由prefixes补全。
+    
+    返回：
+        元组 (pattern, prefixes)，prefixes[缩写] 为该缩写本身及同一位置必然同时匹配的所有缩写
     """
-    errors = []
+    keys = list(contractions.contractions_dict.keys())
+    alternatives = sorted(keys, key=len, reverse=True)
+    # 正则： 确保匹配独立单词，re.escape处理特殊字符（如撇号'）
+    pattern = re.compile(r'\b(?=(' + '|'.join(rf'{re.escape(key)}\b' for key in alternatives) + '))')
+    prefixes = {
+        key: [other for other in keys
+              if other == key or (key.startswith(other) and re.match(rf'{re.escape(other)}\b', key))]
+        for key in keys
+    }
+    return pattern, prefixes
 
+@lru_cache(maxsize=None)
+def get_stopwords(lang='en'):
+    """
+    加载并缓存NLTK停用词表（英文'english'/中文'chinese'），避免每次调用重复读取
+    
+    返回：
+        frozenset: 停用词集合
+    """
     if lang == 'en':
-        stopwords_en = set(nltk.corpus.stopwords.words('english'))
+        return frozenset(nltk.corpus.stopwords.words('english'))
     elif lang == 'zh':
-        stopwords_zh = set(nltk.corpus.stopwords.words('chinese'))
+        return frozenset(nltk.corpus.stopwords.words('chinese'))
     else: 
         raise ValueError("Unsupported language. Use 'en' or 'zh'.")
+
+def test_stopwords(processed:str, lang='en', tokens=None)->list:
+    """
+    假设processed是已经切词用空格分隔连接的字符串；
+    若提供tokens（已切好的token列表），则直接检查tokens，不再切分processed
+    """
+    errors = []
+
+    stopwords = get_stopwords(lang)
             
     # tokens = nltk.word_tokenize(processed) if lang == 'en' else jieba.lcut(processed)
-    tokens = processed.split()
+    if tokens is None:
+        tokens = processed.split()
 
-    if lang == 'en' and any(token in stopwords_en for token in tokens):
+    if lang == 'en' and any(token in stopwords for token in tokens):
         errors.append("英文停用词未移除")
-    if lang == 'zh' and any(token in stopwords_zh for token in tokens):
+    if lang == 'zh' and any(token in stopwords for token in tokens):
         errors.append("中文停用词未移除")
         
     return errors
 
-def test_preprocessed_text(processed, lang)->list:
-    """验证预处理结果"""
+def test_preprocessed_text(processed, lang, tokens=None)->list:
+    """验证预处理结果（tokens为可选的已切好的token列表，用于停用词检查）"""
     errors = []
     # 检查HTML标签是否移除（假设原始文本含HTML标签，此处简化为检查特殊标签字符）
     if '<' in processed or '>' in processed:
@@ -276,7 +1387,7 @@ def test_preprocessed_text(processed, lang)->list:
             errors.extend(err_test_english_contractions)
     
     # 检查停用词移除（英文示例：'the'；中文示例：'的'）
-    err_test_stopwords = test_stopwords(processed, lang)
+    err_test_stopwords = test_stopwords(processed, lang, tokens=tokens)
     if len(err_test_stopwords)>0:
         errors.extend(err_test_stopwords)
 
@@ -1,4 +1,6 @@
 from collections import defaultdict
+import hashlib
+import itertools
 import os
 import time
 import random
@@ -15,7 +17,9 @@ def get_args():
     parser.add_argument("--train", type=str, default="data/sst-train.txt")
     parser.add_argument("--dev", type=str, default="data/sst-dev.txt")
     parser.add_argument("--test", type=str, default="data/sst-test.txt")
+    parser.add_argument("--data_cache_dir", type=str, default=None)  # cache of vocabularies and id-converted datasets (off by default)
     parser.add_argument("--emb_file", type=str, default=None)
+    parser.add_argument("--emb_cache_dir", type=str, default=None)  # cache of the vocab-filtered embedding matrix (off by default)
     parser.add_argument("--emb_size", type=int, default=300)
     parser.add_argument("--hid_size", type=int, default=300)
     parser.add_argument("--hid_layer", type=int, default=3)
@@ -26,6 +30,9 @@ def get_args():
     parser.add_argument("--grad_clip", type=float, default=5.0)
     parser.add_argument("--max_train_epoch", type=int, default=5)
     parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--bucket_size", type=int, default=0)  # batches per length bucket, 0 means no bucketing
+    parser.add_argument("--eval_batch_size", type=int, default=256)
+    parser.add_argument("--bag_input", action="store_true")  # feed flat ids + offsets to model.forward_bag (padding-free once DanModel.classify is implemented)
     parser.add_argument("--lrate", type=float, default=0.005)
     parser.add_argument("--lrate_decay", type=float, default=0)  # 0 means no decay!
     parser.add_argument("--mrate", type=float, default=0.85)
@@ -50,14 +57,111 @@ def convert_text_to_ids(dataset, word_vocab, tag_vocab):
     data = []
     for words, tag in dataset:
         word_ids = [word_vocab[w] for w in words]
-        data.append((word_ids, tag_vocab[tag]))
+        tag_id = tag_vocab[tag]
+        if tag_id is None:  # the tag vocabulary has no <unk>; a missing tag is a vocabulary bug, not an unknown word
+            raise ValueError(f"tag {tag!r} is not in the tag vocabulary {sorted(tag_vocab.word2id)}")
+        data.append((word_ids, tag_id))
     return data
 
-def data_iter(data, batch_size, shuffle=True):
+DATA_CACHE_VERSION = 1  # bump when read_dataset/Vocab/convert_text_to_ids change their output
+
+def dataset_cache_path(cache_dir, filenames, vocab_options):
+    """
+    Path of the cached datasets. The key covers the contents of the data files,
+    the word vocabulary options and DATA_CACHE_VERSION.
+    """
+    key = hashlib.sha1(f'{DATA_CACHE_VERSION}|{sorted(vocab_options.items())}'.encode('utf-8'))
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            key.update(hashlib.sha1(f.read()).digest())
+    return os.path.join(cache_dir, f'dataset.{key.hexdigest()[:16]}.npz')
+
+def save_dataset_cache(path, word_vocab, tag_vocab, datasets):
+    """
+    Save the vocabularies and the id-converted datasets into one .npz file:
+    vocabularies as newline-joined utf-8 bytes, each dataset as flat int32 word ids,
+    int64 sentence offsets and int32 tag ids
+    """
+    arrays = {}
+    for name, vocab in (('word_vocab', word_vocab), ('tag_vocab', tag_vocab)):
+        words = '\n'.join(vocab.id2word[wid] for wid in range(len(vocab)))
+        arrays[name] = np.frombuffer(words.encode('utf-8'), dtype=np.uint8)
+    for name, data in datasets.items():
+        lengths = [len(word_ids) for word_ids, _ in data]
+        arrays[f'{name}_ids'] = np.fromiter(itertools.chain.from_iterable(word_ids for word_ids, _ in data),
+                                            dtype=np.int32, count=sum(lengths))
+        arrays[f'{name}_offsets'] = np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+        arrays[f'{name}_tags'] = np.array([tag for _, tag in data], dtype=np.int32)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+def load_dataset_cache(path, vocab_options, names):
+    """
+    Load the vocabularies and datasets saved by save_dataset_cache
+    Return:
+        word_vocab, tag_vocab, and a dict from dataset name to list((list(int), int))
+    """
+    with np.load(path) as cache:
+        vocabs = []
+        for name, options in (('word_vocab', vocab_options), ('tag_vocab', {})):
+            vocab = Vocab(**options)
+            for word in bytes(cache[name]).decode('utf-8').split('\n'):
+                vocab.add(word)
+            vocabs.append(vocab)
+        datasets = {}
+        for name in names:
+            ids, offsets = cache[f'{name}_ids'].tolist(), cache[f'{name}_offsets'].tolist()
+            datasets[name] = [(ids[offsets[i]:offsets[i + 1]], tag)
+                              for i, tag in enumerate(cache[f'{name}_tags'].tolist())]
+    return vocabs[0], vocabs[1], datasets
+
+def load_datasets(args, vocab_options):
+    """
+    Read the train/dev/test files, build the vocabularies from the training data and
+    convert the datasets to ids; with args.data_cache_dir, reuse the cached result
+    when the data files and vocabulary options are unchanged
+    """
+    filenames = {'train': args.train, 'dev': args.dev, 'test': args.test}
+    path = None
+    if args.data_cache_dir:
+        path = dataset_cache_path(args.data_cache_dir, filenames.values(), vocab_options)
+        if os.path.exists(path):
+            print(f'Loading cached datasets from {path}')
+            word_vocab, tag_vocab, datasets = load_dataset_cache(path, vocab_options, filenames)
+            return word_vocab, tag_vocab, datasets['train'], datasets['dev'], datasets['test']
+
+    # Read datasets
+    train_text = read_dataset(args.train)
+    dev_text = read_dataset(args.dev)
+    test_text = read_dataset(args.test)
+    # Build vocabularies for words and tags from training data
+    word_vocab = Vocab(**vocab_options)
+    word_vocab.build(list(zip(*train_text))[0])
+    tag_vocab = Vocab()
+    tag_vocab.build([list(zip(*train_text))[1]])  # one sentence of whole tags, so '-1' is not split into '-' and '1'
+    # Convert word string to word ids
+    train_data = convert_text_to_ids(train_text, word_vocab, tag_vocab)
+    dev_data = convert_text_to_ids(dev_text, word_vocab, tag_vocab)
+    test_data = convert_text_to_ids(test_text, word_vocab, tag_vocab)
+
+    if path:
+        save_dataset_cache(path, word_vocab, tag_vocab, {'train': train_data, 'dev': dev_data, 'test': test_data})
+        print(f'Saving cached datasets to {path}')
+    return word_vocab, tag_vocab, train_data, dev_data, test_data
+
+def data_iter(data, batch_size, shuffle=True, bucket_size=0):
     """
     Randomly shuffle training data, and partition into batches.
     Each mini-batch may contain sentences with different lengths.
+    If bucket_size > 0, sentences of similar lengths are batched together (see bucket_iter).
     """
+    if bucket_size > 0:
+        yield from bucket_iter(data, batch_size, bucket_size, shuffle)
+        return
+
     if shuffle:
         # Shuffle training data.
         np.random.shuffle(data)
@@ -69,6 +173,48 @@ def data_iter(data, batch_size, shuffle=True):
         tags = [data[i * batch_size + b][1] for b in range(cur_batch_size)]
         yield sents, tags
 
+def bucket_iter(data, batch_size, bucket_size, shuffle=True):
+    """
+    Length-bucketed batches to reduce padding: shuffle the data, cut it into buckets of
+    bucket_size * batch_size sentences, sort each bucket by sentence length and partition
+    it into batches, then shuffle the order of all batches.
+    """
+    if shuffle:
+        np.random.shuffle(data)
+
+    bucket_len = batch_size * bucket_size
+    batches = []
+    for start in range(0, len(data), bucket_len):
+        bucket = sorted(data[start:start + bucket_len], key=lambda example: len(example[0]))
+        batches.extend(bucket[i:i + batch_size] for i in range(0, len(bucket), batch_size))
+    if shuffle:
+        np.random.shuffle(batches)
+
+    for batch in batches:
+        sents, tags = zip(*batch)
+        yield list(sents), list(tags)
+
+def pad_batch(sents, pad_id):
+    """
+    Same padding as pad_sentences, but builds the [batch_size, max_seq_length] LongTensor
+    directly from a numpy array instead of padded Python lists.
+    """
+    lengths = np.fromiter(map(len, sents), dtype=np.int64, count=len(sents))
+    X = np.full((len(sents), lengths.max()), pad_id, dtype=np.int64)
+    X[np.arange(X.shape[1]) < lengths[:, None]] = np.fromiter(
+        itertools.chain.from_iterable(sents), dtype=np.int64, count=lengths.sum())
+    return torch.from_numpy(X)
+
+def flatten_batch(sents):
+    """
+    Padding-free mini-batch for model.forward_bag: all word ids concatenated into one
+    LongTensor [total_words], plus the start offset of each sentence [batch_size]
+    """
+    lengths = np.fromiter(map(len, sents), dtype=np.int64, count=len(sents))
+    ids = np.fromiter(itertools.chain.from_iterable(sents), dtype=np.int64, count=lengths.sum())
+    offsets = np.concatenate([[0], np.cumsum(lengths[:-1])]).astype(np.int64)
+    return torch.from_numpy(ids), torch.from_numpy(offsets)
+
 def pad_sentences(sents, pad_id):
     """
     Adding pad_id to sentences in a mini-batch to ensure that 
@@ -104,19 +250,40 @@ def compute_param_norm(model, norm_type=2):
         total_norm += p_norm
     return total_norm ** (1. / norm_type)
 
-def evaluate(dataset, model, device, tag_vocab=None, filename=None):
+def eval_batches(dataset, batch_size, same_length=True):
+    """
+    Partition the indices of dataset into batches of sentences with the same length
+    (sorted by length, at most batch_size sentences per batch), so no padding is needed.
+    If same_length is False (flat inputs), consecutive sentences in length order are
+    batched regardless of their lengths.
+    """
+    order = sorted(range(len(dataset)), key=lambda i: len(dataset[i][0]))
+    length = (lambda i: len(dataset[i][0])) if same_length else (lambda i: 0)
+    for _, group in itertools.groupby(order, key=length):
+        group = list(group)
+        for start in range(0, len(group), batch_size):
+            yield group[start:start + batch_size]
+
+def evaluate(dataset, model, device, tag_vocab=None, filename=None, batch_size=256, bag_input=False):
     """
     Evaluate test/dev set
+    Sentences are run in batches of equal length (see eval_batches) without autograd,
+    giving the same predictions as running them one by one; predictions keep the original order.
+    With bag_input, batches of any lengths are fed to model.forward_bag as flat ids and offsets.
     """
     model.eval()
-    predicts = []
-    acc = 0
-    for words, tag in dataset:
-        X = torch.LongTensor([words]).to(device)
-        scores = model(X)
-        y_pred = scores.argmax(1)[0].item()
-        predicts.append(y_pred)
-        acc += int(y_pred == tag)
+    predicts = [None] * len(dataset)
+    with torch.inference_mode():
+        for batch in eval_batches(dataset, batch_size, same_length=not bag_input):
+            if bag_input:
+                ids, offsets = flatten_batch([dataset[i][0] for i in batch])
+                scores = model.forward_bag(ids.to(device), offsets.to(device))
+            else:
+                X = torch.LongTensor([dataset[i][0] for i in batch]).to(device)
+                scores = model(X)
+            for i, y_pred in zip(batch, scores.argmax(1).tolist()):
+                predicts[i] = y_pred
+    acc = sum(int(y_pred == tag) for y_pred, (_, tag) in zip(predicts, dataset))
     print(f'  -Accuracy: {acc/len(predicts):.4f} ({acc}/{len(predicts)})')
     if filename:
         with open(filename, 'w') as f:
@@ -135,25 +302,16 @@ def main():
     np.random.seed(_seed)
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    # Read datasets
-    train_text = read_dataset(args.train)
-    dev_text = read_dataset(args.dev)
-    test_text = read_dataset(args.test)
-    # Build vocabularies for words and tags from training data
-    word_vocab = Vocab(pad=True, unk=True)
-    word_vocab.build(list(zip(*train_text))[0])
-    tag_vocab = Vocab()
-    tag_vocab.build(list(zip(*train_text))[1])
-    # Convert word string to word ids
-    train_data = convert_text_to_ids(train_text, word_vocab, tag_vocab)
-    dev_data = convert_text_to_ids(dev_text, word_vocab, tag_vocab)
-    test_data = convert_text_to_ids(test_text, word_vocab, tag_vocab)
+    # Read datasets, build vocabularies and convert word strings to word ids (cached)
+    word_vocab, tag_vocab, train_data, dev_data, test_data = load_datasets(args, dict(pad=True, unk=True))
 
     # Create a model
     nwords = len(word_vocab)
     ntags = len(tag_vocab)
     print('nwords', nwords, 'ntags', ntags)
-    model = mn.DanModel(args, word_vocab, len(tag_vocab)).to(device)
+    # Load the pre-trained embeddings (from the .npy cache when --emb_cache_dir is given)
+    emb = mn.load_embedding_cached(word_vocab, args.emb_file, args.emb_size, args.emb_cache_dir) if args.emb_file is not None else None
+    model = mn.DanModel(args, word_vocab, len(tag_vocab), emb=emb).to(device)
     loss_func = nn.CrossEntropyLoss()
     optimizer = torch.optim.Adagrad(model.parameters(), lr=args.lrate, lr_decay=args.lrate_decay)
 
@@ -161,16 +319,30 @@ def main():
     start_time = time.time()
     train_iter = 0
     train_loss = train_example = train_correct = 0
+    train_tokens = train_padded = 0
+    log_time = time.time()
     best_records = (0, 0)  # [best_iter, best_accuracy]
     for epoch in range(args.max_train_epoch):
-        for batch in data_iter(train_data, batch_size=args.batch_size, shuffle=True):
+        for batch in data_iter(train_data, batch_size=args.batch_size, shuffle=True, bucket_size=args.bucket_size):
             train_iter += 1
 
-            X = pad_sentences(batch[0], word_vocab['<pad>'])
-            X = torch.LongTensor(X).to(device)
             Y = torch.LongTensor(batch[1]).to(device)
-            # Forward pass: compute the unnormalized scores for P(Y|X)
-            scores = model(X)
+            train_tokens += sum(len(words) for words in batch[0])
+            if args.bag_input:
+                # Forward pass on flat word ids + offsets, no padding unless forward_bag re-pads
+                ids, offsets = flatten_batch(batch[0])
+                scores = model.forward_bag(ids.to(device), offsets.to(device))
+                train_padded += len(ids) if model.bag_padding_free else \
+                    len(batch[0]) * max(len(words) for words in batch[0])
+            else:
+                if args.bucket_size > 0:
+                    X = pad_batch(batch[0], word_vocab['<pad>']).to(device)
+                else:
+                    X = pad_sentences(batch[0], word_vocab['<pad>'])
+                    X = torch.LongTensor(X).to(device)
+                train_padded += X.numel()
+                # Forward pass: compute the unnormalized scores for P(Y|X)
+                scores = model(X)
             loss = loss_func(scores, Y)
             # Backpropagation: compute gradients for all parameters
             optimizer.zero_grad()
@@ -192,12 +364,17 @@ def main():
                     f'loss={train_loss/train_example:.4f}, '\
                     f'accuracy={train_correct/train_example:.2f} ({train_correct}/{train_example}), '\
                     f'gradient_norm={gnorm:.2f}, params_norm={pnorm:.2f}, '\
+                    f'padding_efficiency={train_tokens/train_padded:.2f}, '\
+                    f'examples/s={train_example/(time.time()-log_time):.0f}, '\
                     f'time={time.time()-start_time:.2f}s')
                 train_loss = train_example = train_correct = 0
+                train_tokens = train_padded = 0
+                log_time = time.time()
 
             if train_iter % args.eval_niter == 0:
                 print(f'Evaluate dev data:')
-                dev_accuracy = evaluate(dev_data, model, device) 
+                dev_accuracy = evaluate(dev_data, model, device, batch_size=args.eval_batch_size,
+                                        bag_input=args.bag_input)
                 if dev_accuracy > best_records[1]:
                     print(f'  -Update best model at {train_iter}, dev accuracy={dev_accuracy:.4f}')
                     best_records = (train_iter, dev_accuracy)
@@ -205,8 +382,10 @@ def main():
 
     # Load the best model
     model.load(args.model)
-    evaluate(test_data, model, device, tag_vocab, filename=args.test_output)
-    evaluate(dev_data, model, device, tag_vocab, filename=args.dev_output)
+    evaluate(test_data, model, device, tag_vocab, filename=args.test_output,
+             batch_size=args.eval_batch_size, bag_input=args.bag_input)
+    evaluate(dev_data, model, device, tag_vocab, filename=args.dev_output,
+             batch_size=args.eval_batch_size, bag_input=args.bag_input)
 
 
 if __name__ == '__main__':
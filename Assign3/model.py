@@ -1,6 +1,8 @@
 import torch
 import torch.nn as nn
 import zipfile
+import hashlib
+import os
 import numpy as np
 
 class BaseModel(nn.Module):
@@ -32,6 +34,9 @@ class BaseModel(nn.Module):
 def load_embedding(vocab, emb_file, emb_size):
     """
     Read embeddings for words in the vocabulary from the emb_file (e.g., GloVe, FastText).
+    Stream the file line by line and only keep the rows of words in `vocab`, so that
+    a multi-hundred-MB file is never held in memory. Use load_embedding_cached to avoid
+    re-parsing the text file on every run.
     Args:
         vocab: (Vocab), a word vocabulary
         emb_file: (string), the path to the embdding file for loading
@@ -42,15 +47,78 @@ def load_embedding(vocab, emb_file, emb_size):
     raise NotImplementedError()
 
 
+def embedding_cache_path(vocab, emb_file, emb_size, cache_dir):
+    """
+    Path of the cached embedding matrix. The key covers the path, size and modification time
+    of emb_file, emb_size and the words of `vocab` in id order, so a changed embedding file
+    or vocabulary never reuses a stale matrix.
+    """
+    stat = os.stat(emb_file)
+    key = hashlib.sha1(f'{os.path.abspath(emb_file)}|{stat.st_size}|{stat.st_mtime_ns}|{emb_size}'.encode('utf-8'))
+    for wid in range(len(vocab)):
+        key.update(vocab.id2word[wid].encode('utf-8') + b'\n')
+    return os.path.join(cache_dir, f'{os.path.basename(emb_file)}.{emb_size}d.{key.hexdigest()[:16]}.npy')
+
+
+def load_embedding_cached(vocab, emb_file, emb_size, cache_dir=None):
+    """
+    Cached load_embedding: the first call parses emb_file with load_embedding and saves the
+    (|vocab|, emb_size) matrix as a binary .npy file in cache_dir; later runs (e.g., every job
+    of a hyperparameter sweep) memory-map that file instead of parsing the text file.
+    Args:
+        vocab: (Vocab), a word vocabulary
+        emb_file: (string), the path to the embdding file for loading
+        emb_size: (int), the embedding size (e.g., 300, 100) depending on emb_file
+        cache_dir: (string), the cache directory; None (default) or '' disables the cache
+    Return:
+        emb: (np.array), float32 embedding matrix of size (|vocab|, emb_size)
+    """
+    if not cache_dir:
+        return load_embedding(vocab, emb_file, emb_size)
+    path = embedding_cache_path(vocab, emb_file, emb_size, cache_dir)
+    if os.path.exists(path):
+        print(f'Loading cached embeddings from {path}')
+        return np.load(path, mmap_mode='c')  # copy-on-write: writable, pages are read on demand
+    emb = np.asarray(load_embedding(vocab, emb_file, emb_size), dtype=np.float32)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'  # write then rename, so concurrent jobs never read a partial file
+    with open(tmp_path, 'wb') as f:
+        np.save(f, emb)
+    os.replace(tmp_path, path)
+    print(f'Saving cached embeddings to {path}')
+    return emb
+
+
+def embedding_bag_pool(embedding, ids, offsets, pooling_method):
+    """
+    Padding-free sum/avg/max pooling of word embeddings with the fused embedding_bag kernel:
+    the embedding lookup and the pooling are done in one step, only over the real words.
+    Gives the same result as pooling the padded [batch_size, seq_length, emb_size] embeddings
+    with the pad positions masked out.
+    Args:
+        embedding: (nn.Embedding), the word embedding layer
+        ids: (torch.LongTensor), [total_words], word ids of all sentences concatenated
+        offsets: (torch.LongTensor), [batch_size], start position of each sentence in ids
+        pooling_method: (string), "sum", "avg" or "max"
+    Return:
+        pooled: (torch.FloatTensor), [batch_size, emb_size]
+    """
+    mode = {'sum': 'sum', 'avg': 'mean', 'max': 'max'}[pooling_method]
+    return nn.functional.embedding_bag(ids, embedding.weight, offsets, mode=mode)
+
+
 class DanModel(BaseModel):
-    def __init__(self, args, vocab, tag_size):
+    def __init__(self, args, vocab, tag_size, emb=None):
         super(DanModel, self).__init__(args, vocab, tag_size)
         self.define_model_parameters()
         self.init_model_parameters()
 
-        # Use pre-trained word embeddings if emb_file exists
+        # Use pre-trained word embeddings if emb_file exists; the driver passes the matrix
+        # loaded by load_embedding_cached, other callers parse emb_file here
         if args.emb_file is not None:
-            self.copy_embedding_from_numpy()
+            if emb is None:
+                emb = load_embedding(vocab, args.emb_file, args.emb_size)
+            self.copy_embedding_from_numpy(emb)
 
     def define_model_parameters(self):
         """
@@ -66,10 +134,13 @@ class DanModel(BaseModel):
         """
         raise NotImplementedError()
 
-    def copy_embedding_from_numpy(self):
+    def copy_embedding_from_numpy(self, emb):
         """
         Load pre-trained word embeddings from numpy.array to nn.embedding
         Pass hyperparameters explicitly or use self.args to access the hyperparameters.
+        Args:
+            emb: (np.array), embedding matrix of size (|vocab|, emb_size) from load_embedding
+                 or load_embedding_cached (may be a copy-on-write memory map of the cache file)
         """
         raise NotImplementedError()
 
@@ -85,3 +156,55 @@ class DanModel(BaseModel):
             scores: (torch.FloatTensor), [batch_size, ntags]
         """
         raise NotImplementedError()
+
+    def classify(self, h):
+        """
+        Optional: the layers of forward after the pooling step, from the pooled sentence
+        representation to the scores. Implement it (using the same layers as forward) to make
+        forward_bag padding-free; without it forward_bag falls back to the padded input.
+        Args:
+            h: (torch.FloatTensor), [batch_size, emb_size], pooled word embeddings
+        Return:
+            scores: (torch.FloatTensor), [batch_size, ntags]
+        """
+        raise NotImplementedError()
+
+    @property
+    def bag_padding_free(self):
+        """Whether forward_bag pools with embedding_bag_pool (classify is implemented) instead of re-padding"""
+        return type(self).classify is not DanModel.classify
+
+    def forward_bag(self, ids, offsets):
+        """
+        Padding-free input path (used with --bag_input): the sentences of a mini-batch are given
+        as flat word ids plus per-sentence offsets (see main.flatten_batch).
+        If classify is implemented (bag_padding_free), word dropout is applied to ids, then
+        h = embedding_bag_pool(self.embedding, ids, offsets, self.args.pooling_method) looks up and
+        pools only the real words, and classify(h) gives the scores. Word dropout keeps the training
+        distribution of forward: each real word is dropped with probability args.word_drop (training
+        only) and the offsets are recomputed from the kept counts. A sentence whose words are all
+        dropped becomes an empty bag (a zero vector); forward has to treat that case the same way for
+        the two paths to agree. The random draws differ from forward's, so only the distribution
+        (not the batch) matches.
+        Otherwise the padded [batch_size, max_seq_length] input is rebuilt (pad_id after each sentence,
+        as main.pad_batch does) and forward is called, so --bag_input works as soon as forward does,
+        with exactly the scores (and the padding cost) of the padded path.
+        Args:
+            ids: (torch.LongTensor), [total_words]
+            offsets: (torch.LongTensor), [batch_size]
+        Return:
+            scores: (torch.FloatTensor), [batch_size, ntags]
+        """
+        lengths = torch.diff(offsets, append=offsets.new_tensor([ids.numel()]))
+        if self.bag_padding_free:
+            if self.training and self.args.word_drop > 0:
+                keep = torch.rand(ids.shape, device=ids.device) >= self.args.word_drop
+                sent = torch.repeat_interleave(torch.arange(len(offsets), device=ids.device), lengths)
+                lengths = torch.bincount(sent[keep], minlength=len(offsets))
+                ids, offsets = ids[keep], torch.cumsum(lengths, 0) - lengths
+            h = embedding_bag_pool(self.embedding, ids, offsets, self.args.pooling_method)
+            return self.classify(h)
+        x = torch.full((len(offsets), int(lengths.max())), self.vocab.pad_id,
+                       dtype=ids.dtype, device=ids.device)
+        x[torch.arange(x.size(1), device=ids.device) < lengths[:, None]] = ids
+        return self.forward(x)